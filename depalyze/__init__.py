@@ -1,4 +1,7 @@
 from versionhistory import *
+from compacthistory import CompactVersionHistories, ReadOnlyHistory
+from sqlitehistory import SqliteVersionHistories
+from snapshot import write_snapshot, open_snapshot
 from cranscan import scan_R_descriptions
 from eclipsescan import scan_eclipse_xml
 from npmscan import scan_npm_json
@@ -0,0 +1,98 @@
+from lrucache import LRUCache
+
+class SuffixAutomaton:
+    """Suffix automaton of a string: finds its longest common substring with any other string
+    in time linear in the other string's length"""
+    def __init__(self, s):
+        self.s = s
+        self.next = [{}]
+        self.link = [-1]
+        self.length = [0]
+        last = 0
+        for ch in s:
+            cur = self.state(self.length[last] + 1, {}, 0)
+            p = last
+            while p != -1 and ch not in self.next[p]:
+                self.next[p][ch] = cur
+                p = self.link[p]
+            if p != -1:
+                q = self.next[p][ch]
+                if self.length[p] + 1 == self.length[q]:
+                    self.link[cur] = q
+                else:
+                    clone = self.state(self.length[p] + 1, dict(self.next[q]), self.link[q])
+                    while p != -1 and self.next[p].get(ch) == q:
+                        self.next[p][ch] = clone
+                        p = self.link[p]
+                    self.link[q] = clone
+                    self.link[cur] = clone
+            last = cur
+
+    def state(self, length, next, link):
+        self.length.append(length)
+        self.next.append(next)
+        self.link.append(link)
+        return len(self.length) - 1
+
+    def longest_common_substring(self, t):
+        (v, l, best, end) = (0, 0, 0, 0)
+        for (i, ch) in enumerate(t):
+            while v != 0 and ch not in self.next[v]:
+                v = self.link[v]
+                l = self.length[v]
+            if ch in self.next[v]:
+                v = self.next[v][ch]
+                l += 1
+            else:
+                (v, l) = (0, 0)
+            if l > best:
+                (best, end) = (l, i + 1)
+        return t[end - best:end]
+
+class AuthorSimilarity:
+    """Longest common substrings of author strings, memoized
+
+    Authors are interned as integer ids; the answers for the maxsize most
+    recently compared pairs of ids are remembered, and so are the suffix
+    automata of the most recently used authors.  A pair is always compared by
+    matching the later of the two author strings against the automaton of the
+    earlier one, so when there are ties the substring found doesn't depend on
+    which of them was asked about, or interned, first.
+    """
+    def __init__(self, maxsize=100000, automata=1000):
+        self.ids = {}
+        self.names = []
+        self.memo = LRUCache(maxsize)
+        self.automata = LRUCache(automata)
+
+    def intern(self, author):
+        if author not in self.ids:
+            self.ids[author] = len(self.names)
+            self.names.append(author)
+        return self.ids[author]
+
+    def automaton(self, i):
+        return self.automata.get(i, lambda: SuffixAutomaton(self.names[i]))
+
+    def common(self, a, b):
+        """Longest common substring of author strings a and b"""
+        return self.common_with_many(a, [b])[0]
+
+    def common_with_many(self, a, others):
+        """Longest common substrings of author string a with each of several others"""
+        i = self.intern(a)
+        result = []
+        for b in others:
+            j = self.intern(b)
+            (lo, hi) = (i, j) if a <= b else (j, i)
+            result.append(self.memo.get((min(i, j), max(i, j)),
+                                        lambda: self.automaton(lo).longest_common_substring(self.names[hi])))
+        return result
+
+    def score(self, a, b):
+        """Length of the longest common substring of author strings a and b"""
+        return len(self.common(a, b))
+
+    def scores(self, a, others):
+        """Length of the longest common substring of author string a with each of several others"""
+        return [len(c) for c in self.common_with_many(a, others)]
@@ -0,0 +1,128 @@
+import numpy as np
+
+class TransitiveClosure:
+    """Transitive dependencies and dependents of every package in a VersionHistories
+
+    The dependency graph (present_dependencies of each package, or every
+    dependency it ever had if present=False) is collapsed into its strongly
+    connected components, which are found iteratively so deep chains can't
+    overflow the stack.  A component's closure is the sorted array of package
+    ids reachable from it, computed once from its successors' closures and
+    memoized, so shared subtrees and cycles cost nothing extra.
+
+    A package is never counted among its own transitive dependencies or
+    dependents, even when it is part of a cycle.
+    """
+
+    def __init__(self, vh, present=True):
+        from versionhistory import NoVersionsException
+        self.names = sorted(vh.packages())
+        self.ids = { p: i for (i, p) in enumerate(self.names) }
+        self.edges = []
+        for p in self.names:
+            try:
+                deps = vh.present_dependencies(p) if present else vh.dependencies(p)
+            except NoVersionsException:
+                deps = []
+            self.edges.append(sorted(set(self.ids[d] for d in deps if d in self.ids)))
+        self.find_components()
+        self.successors = { "forward": [set() for c in self.members], "reverse": [set() for c in self.members] }
+        for (u, ds) in enumerate(self.edges):
+            for v in ds:
+                (cu, cv) = (self.component[u], self.component[v])
+                if cu != cv:
+                    self.successors["forward"][cu].add(cv)
+                    self.successors["reverse"][cv].add(cu)
+        self.memo = { "forward": {}, "reverse": {} }
+
+    def find_components(self):
+        """Tarjan's strongly connected components algorithm, with an explicit stack"""
+        n = len(self.names)
+        index = [-1] * n
+        lowlink = [0] * n
+        onstack = [False] * n
+        stack = []
+        self.component = [-1] * n
+        self.members = []
+        counter = 0
+        for root in range(n):
+            if index[root] >= 0:
+                continue
+            work = [(root, 0)]
+            while work:
+                (u, i) = work.pop()
+                if i == 0:
+                    index[u] = lowlink[u] = counter
+                    counter += 1
+                    stack.append(u)
+                    onstack[u] = True
+                else:
+                    lowlink[u] = min(lowlink[u], lowlink[self.edges[u][i-1]])
+                while i < len(self.edges[u]):
+                    v = self.edges[u][i]
+                    i += 1
+                    if index[v] < 0:
+                        work.append((u, i))
+                        work.append((v, 0))
+                        break
+                    elif onstack[v]:
+                        lowlink[u] = min(lowlink[u], index[v])
+                else:
+                    if lowlink[u] == index[u]:
+                        members = []
+                        while True:
+                            w = stack.pop()
+                            onstack[w] = False
+                            self.component[w] = len(self.members)
+                            members.append(w)
+                            if w == u:
+                                break
+                        self.members.append(np.array(sorted(members), dtype=np.int32))
+
+    def reach(self, c, direction):
+        """Sorted ids of the packages in component c and every component reachable from it"""
+        memo = self.memo[direction]
+        successors = self.successors[direction]
+        work = [c]
+        while work:
+            x = work[-1]
+            if x in memo:
+                work.pop()
+                continue
+            pending = [y for y in successors[x] if y not in memo]
+            if pending:
+                work.extend(pending)
+                continue
+            memo[x] = np.unique(np.concatenate([self.members[x]] + [memo[y] for y in successors[x]]))
+            work.pop()
+        return memo[c]
+
+    def closure_ids(self, package, direction):
+        pid = self.ids[package]
+        ids = self.reach(self.component[pid], direction)
+        return ids[ids != pid]
+
+    def dependencies(self, package):
+        """Set of packages that package depends on, directly or indirectly"""
+        return set(self.names[i] for i in self.closure_ids(package, "forward"))
+
+    def dependents(self, package):
+        """Set of packages that depend on package, directly or indirectly"""
+        return set(self.names[i] for i in self.closure_ids(package, "reverse"))
+
+    def counts(self, direction):
+        """{ package: number of transitive dependencies ("forward") or dependents ("reverse") }"""
+        result = {}
+        for (c, members) in enumerate(self.members):
+            n = len(self.reach(c, direction))
+            for pid in members:
+                result[self.names[pid]] = n - 1
+        return result
+
+    def fan_out(self):
+        """{ package: number of packages it transitively depends on } for every package"""
+        return self.counts("forward")
+
+    def fan_in(self):
+        """{ package: number of packages that transitively depend on it } for every package"""
+        return self.counts("reverse")
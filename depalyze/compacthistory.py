@@ -0,0 +1,391 @@
+import calendar
+import collections
+import datetime
+import numpy as np
+import pytz
+from versionhistory import VersionHistories, NoVersionsException
+from lrucache import LRUCache
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=pytz.UTC)
+
+def to_micros(t):
+    """Microseconds since the epoch of a datetime; naive datetimes are taken to be UTC"""
+    return calendar.timegm(t.utctimetuple())*1000000 + t.microsecond
+
+def from_micros(us):
+    return EPOCH + datetime.timedelta(microseconds=int(us))
+
+def utf8(s):
+    return s.encode("utf-8") if isinstance(s, unicode) else s
+
+class ReadOnlyHistory(TypeError):
+    """Raised on attempts to change a CompactVersionHistories"""
+    pass
+
+class StringPool:
+    """Intern a set of strings as integer ids; ids are assigned in order of their utf-8 encodings"""
+    def __init__(self, strings):
+        self.strings = sorted(set(strings), key=utf8)
+        self.ids = { s: i for (i, s) in enumerate(self.strings) }
+
+    def id(self, s):
+        """id of s, or -1 if it is not in the pool"""
+        return self.ids.get(s, -1)
+
+    def __getitem__(self, i): return self.strings[i]
+
+    def __len__(self): return len(self.strings)
+
+class CompactAuthors(collections.Mapping):
+    """Read-only da: package -> author"""
+    def __init__(self, store): self.store = store
+    def __getitem__(self, p):
+        pid = self.store.package_id(p)
+        if pid < 0 or self.store.cols["pkg_author"][pid] < 0:
+            raise KeyError(p)
+        return self.store.authors[self.store.cols["pkg_author"][pid]]
+    def __iter__(self):
+        for pid in np.flatnonzero(self.store.cols["pkg_author"] >= 0):
+            yield self.store.names[pid]
+    def __len__(self): return int(np.count_nonzero(self.store.cols["pkg_author"] >= 0))
+
+class CompactDates(collections.Mapping):
+    """Read-only dc: package -> version -> date"""
+    def __init__(self, store): self.store = store
+    def __getitem__(self, p): return PackageDates(self.store, self.store.known_package_id(p))
+    def __iter__(self): return self.store.packages()
+    def __len__(self): return int(np.count_nonzero(self.store.cols["pkg_known"]))
+
+class PackageDates(collections.Mapping):
+    """Read-only dc[p]: version -> date"""
+    def __init__(self, store, pid):
+        self.store = store
+        self.pid = pid
+    def __getitem__(self, v):
+        return from_micros(self.store.cols["ver_time"][self.store.version_row(self.pid, v)])
+    def __iter__(self):
+        (s, e) = self.store.version_rows(self.pid)
+        for vid in self.store.cols["ver_name"][s:e]:
+            yield self.store.vnames[vid]
+    def __len__(self):
+        (s, e) = self.store.version_rows(self.pid)
+        return e - s
+
+class CompactDeps(collections.Mapping):
+    """Read-only dv: package -> version -> import name -> [(type, versionrefstring)]"""
+    def __init__(self, store): self.store = store
+    def __getitem__(self, p): return PackageDeps(self.store, self.store.known_package_id(p))
+    def __iter__(self): return self.store.packages()
+    def __len__(self): return int(np.count_nonzero(self.store.cols["pkg_known"]))
+
+class PackageDeps(PackageDates):
+    """Read-only dv[p]: version -> import name -> [(type, versionrefstring)]
+
+    Each version's dependencies are returned as a new, ordinary dict."""
+    def __getitem__(self, v):
+        return self.store.row_dependencies(self.store.version_row(self.pid, v))
+
+class CompactReverseDeps(collections.Mapping):
+    """Read-only rdepscache: package -> set of packages that have ever depended on it"""
+    def __init__(self, store):
+        self.store = store
+        self.count = int(np.count_nonzero(np.diff(store.cols["rdep_start"])))
+    def __getitem__(self, d):
+        pid = self.store.package_id(d)
+        if pid < 0:
+            return set()
+        (s, e) = self.store.reverse_rows(pid)
+        return set(self.store.names[q] for q in self.store.cols["rdep_pkg"][s:e])
+    def __iter__(self):
+        for pid in np.flatnonzero(np.diff(self.store.cols["rdep_start"])):
+            yield self.store.names[pid]
+    def __len__(self): return self.count
+
+class CompactReverseTimes(CompactReverseDeps):
+    """Read-only rdeptimes: package -> downstream package -> [(versionrefstring, start, end)]"""
+    def __getitem__(self, d):
+        pid = self.store.package_id(d)
+        if pid < 0:
+            return {}
+        (s, e) = self.store.reverse_rows(pid)
+        return { self.store.names[self.store.cols["rdep_pkg"][k]]: self.store.reverse_spans(k) for k in range(s, e) }
+
+class CompactVersionHistories(VersionHistories):
+    """VersionHistories stored in flat numpy arrays, for ecosystems too big for nested dicts
+
+    Package, version, author, dependency type, and constraint strings are interned
+    in StringPools.  A package's versions occupy a contiguous run of version rows,
+    in chronological order, with release times as int64 microseconds since the
+    epoch; each version row's dependencies occupy a contiguous run of edge rows
+    (CSR layout):
+
+      pkg_known[pid], pkg_author[pid]     one per name in self.names
+      pkg_vstart[pid]:pkg_vstart[pid+1]   version rows of package pid
+      ver_name[row], ver_time[row]        one per version
+      ver_estart[row]:ver_estart[row+1]   edge rows of version row
+      edge_dep, edge_tag, edge_con        one per (import name, type, versionrefstring); an import
+                                          name with no refs gets one edge with tag and con -1
+
+    Once built, reverse dependencies are kept in the same way:
+
+      rdep_start[pid]:rdep_start[pid+1]   rows of packages that have depended on pid
+      rdep_pkg[k]                         one per (package, downstream package)
+      rdep_sstart[k]:rdep_sstart[k+1]     spans of dep_version_spans(rdep_pkg[k], pid)
+      span_con, span_begin, span_end      one per span
+
+    self.da, self.dc, and self.dv are read-only views over the arrays, so existing
+    analysis code works unchanged; the accessors (versions, dependencies,
+    date_of_version, present_dependencies) read the arrays directly.  To change
+    the data, update an ordinary VersionHistories and compact it again.
+    """
+
+    def __init__(self):
+        VersionHistories.__init__(self)
+        self.build({}, {}, {})
+
+    @staticmethod
+    def compact(vh):
+        """Compact copy of a VersionHistories"""
+        cvh = CompactVersionHistories()
+        cvh.logwith = vh.logwith
+        cvh.preload(vh.da, vh.dc, vh.dv, vh.end_of_time)
+        cvh.auxdata = vh.auxdata
+        return cvh
+
+    def preload(self, da, dc, dv, end_of_time):
+        self.depscache = {}
+        self.rdepscache = {}
+        self.rdeptimes = {}
+        self.end_of_time = end_of_time
+        if self.end_of_time.tzinfo is None:
+            self.end_of_time = self.end_of_time.replace(tzinfo=pytz.UTC)
+        self.build(da, dc, dv)
+
+    def build(self, da, dc, dv):
+        """Replace the arrays with the contents of ordinary da, dc, dv dicts"""
+        depnames = set(d for p in dv for v in dv[p] for d in dv[p][v])
+        refs = [r for p in dv for v in dv[p] for d in dv[p][v] for r in dv[p][v][d]]
+        names = StringPool(set(dc) | set(dv) | set(da) | depnames)
+        authors = StringPool(da.values())
+        vnames = StringPool(v for p in dc for v in dc[p])
+        tags = StringPool(t for (t, c) in refs)
+        constraints = StringPool(c for (t, c) in refs)
+        del refs, depnames
+
+        pkg_known = np.zeros(len(names), dtype=np.int8)
+        pkg_author = np.full(len(names), -1, dtype=np.int32)
+        pkg_vstart = [0]
+        ver_name = []
+        ver_time = []
+        ver_estart = [0]
+        edge_dep = []
+        edge_tag = []
+        edge_con = []
+        for (pid, p) in enumerate(names.strings):
+            if p in da:
+                pkg_author[pid] = authors.id(da[p])
+            if p in dc:
+                pkg_known[pid] = 1
+                for v in sorted(dc[p].keys(), key=lambda v: dc[p][v]):
+                    ver_name.append(vnames.id(v))
+                    ver_time.append(to_micros(dc[p][v]))
+                    deps = dv.get(p, {}).get(v, {})
+                    for d in deps:
+                        for (t, c) in deps[d] or [(None, None)]:
+                            edge_dep.append(names.id(d))
+                            edge_tag.append(tags.id(t))
+                            edge_con.append(constraints.id(c))
+                    ver_estart.append(len(edge_dep))
+            pkg_vstart.append(len(ver_name))
+
+        self.names = names
+        self.authors = authors
+        self.vnames = vnames
+        self.tags = tags
+        self.constraints = constraints
+        self.cols = {
+            "pkg_known": pkg_known,
+            "pkg_author": pkg_author,
+            "pkg_vstart": np.array(pkg_vstart, dtype=np.int64),
+            "ver_name": np.array(ver_name, dtype=np.int32),
+            "ver_time": np.array(ver_time, dtype=np.int64),
+            "ver_estart": np.array(ver_estart, dtype=np.int64),
+            "edge_dep": np.array(edge_dep, dtype=np.int32),
+            "edge_tag": np.array(edge_tag, dtype=np.int32),
+            "edge_con": np.array(edge_con, dtype=np.int32)}
+        self.build_reverse({})
+        self.attach_views()
+
+    def build_reverse(self, rdeptimes):
+        """Replace the reverse dependency arrays with the contents of an ordinary rdeptimes dict"""
+        rdep_start = [0]
+        rdep_pkg = []
+        rdep_sstart = [0]
+        span_con = []
+        span_begin = []
+        span_end = []
+        for d in self.names.strings:
+            for p in sorted(rdeptimes.get(d, {}), key=utf8):
+                rdep_pkg.append(self.names.id(p))
+                for (ref, st, en) in rdeptimes[d][p]:
+                    span_con.append(self.constraints.id(ref))
+                    span_begin.append(to_micros(st))
+                    span_end.append(to_micros(en))
+                rdep_sstart.append(len(span_con))
+            rdep_start.append(len(rdep_pkg))
+        self.cols["rdep_start"] = np.array(rdep_start, dtype=np.int64)
+        self.cols["rdep_pkg"] = np.array(rdep_pkg, dtype=np.int32)
+        self.cols["rdep_sstart"] = np.array(rdep_sstart, dtype=np.int64)
+        self.cols["span_con"] = np.array(span_con, dtype=np.int32)
+        self.cols["span_begin"] = np.array(span_begin, dtype=np.int64)
+        self.cols["span_end"] = np.array(span_end, dtype=np.int64)
+        self.rdepscache = CompactReverseDeps(self)
+        self.rdeptimes = CompactReverseTimes(self)
+
+    def attach_views(self):
+        self.da = CompactAuthors(self)
+        self.dc = CompactDates(self)
+        self.dv = CompactDeps(self)
+        self.depscache = {}
+        self.rdepscache = CompactReverseDeps(self)
+        self.rdeptimes = CompactReverseTimes(self)
+        self.rowcache = {}
+        self.vindex = LRUCache(4096)
+        self.fingerprints = {}
+        self.graphcache = {}
+
+    def buildReverseDependencies(self, processes=None, shard_size=1000):
+        VersionHistories.buildReverseDependencies(self, processes, shard_size)
+        self.build_reverse(self.rdeptimes)
+
+    def set_end_of_time(self, end_of_time):
+        old_end_of_time = self.end_of_time
+        self.end_of_time = end_of_time
+        if self.end_of_time.tzinfo is None:
+            self.end_of_time = self.end_of_time.replace(tzinfo=pytz.UTC)
+        span_end = self.cols["span_end"]
+        span_end[span_end == to_micros(old_end_of_time)] = to_micros(self.end_of_time)
+
+    def histories(self):
+        """(da, dc, dv) as ordinary nested dicts"""
+        da = dict(self.da.iteritems())
+        dc = { p: dict(self.dc[p].iteritems()) for p in self.dc }
+        dv = { p: dict(self.dv[p].iteritems()) for p in self.dv }
+        return (da, dc, dv)
+
+    def serialize(self):
+        dct = VersionHistories.serialize(self)
+        (dct["da"], dct["dc"], dct["dv"]) = self.histories()
+        return dct
+
+    def force_timezone_awareness(self):
+        pass   # times are always stored as UTC
+
+    def update_package(self, package, author, dc, dv):
+        raise ReadOnlyHistory("CompactVersionHistories is read-only; update an ordinary VersionHistories and compact it again")
+
+    def remove_package(self, package):
+        raise ReadOnlyHistory("CompactVersionHistories is read-only; update an ordinary VersionHistories and compact it again")
+
+    def package_id(self, p):
+        return self.names.id(p)
+
+    def known_package_id(self, p):
+        """id of a package with version history; KeyError if there is none"""
+        pid = self.names.id(p)
+        if pid < 0 or not self.cols["pkg_known"][pid]:
+            raise KeyError(p)
+        return pid
+
+    def version_rows(self, pid):
+        """(start, end) range of the version rows of package pid"""
+        return (int(self.cols["pkg_vstart"][pid]), int(self.cols["pkg_vstart"][pid+1]))
+
+    def version_row(self, pid, v):
+        """Version row of version v of package pid; KeyError if there is none"""
+        if pid not in self.rowcache:
+            if len(self.rowcache) > 1024:
+                self.rowcache = {}
+            (s, e) = self.version_rows(pid)
+            self.rowcache[pid] = { int(vid): s+i for (i, vid) in enumerate(self.cols["ver_name"][s:e]) }
+        row = self.rowcache[pid].get(self.vnames.id(v))
+        if row is None:
+            raise KeyError(v)
+        return row
+
+    def reverse_rows(self, pid):
+        """(start, end) range of the reverse dependency rows of package pid"""
+        return (int(self.cols["rdep_start"][pid]), int(self.cols["rdep_start"][pid+1]))
+
+    def reverse_spans(self, k):
+        """[(versionrefstring, start, end)] for one reverse dependency row"""
+        (s, e) = (self.cols["rdep_sstart"][k], self.cols["rdep_sstart"][k+1])
+        return [(self.constraints[c], from_micros(b), from_micros(en)) for (c, b, en) in
+                   zip(self.cols["span_con"][s:e], self.cols["span_begin"][s:e], self.cols["span_end"][s:e])]
+
+    def row_dependencies(self, row):
+        """import name -> [(type, versionrefstring)] for one version row"""
+        (s, e) = (self.cols["ver_estart"][row], self.cols["ver_estart"][row+1])
+        deps = {}
+        for (d, t, c) in zip(self.cols["edge_dep"][s:e], self.cols["edge_tag"][s:e], self.cols["edge_con"][s:e]):
+            refs = deps.setdefault(self.names[d], [])
+            if t >= 0:
+                refs.append((self.tags[t], self.constraints[c]))
+        return deps
+
+    def packages(self):
+        for pid in np.flatnonzero(self.cols["pkg_known"]):
+            yield self.names[pid]
+
+    def versions(self, package):
+        """List all known versions of this package, in chrono order"""
+        (s, e) = self.version_rows(self.known_package_id(package))
+        return [self.vnames[vid] for vid in self.cols["ver_name"][s:e]]
+
+    def version_index(self, package):
+        """([versions], [dates]) of this package, in chrono order, for the most recently used packages"""
+        def index():
+            (s, e) = self.version_rows(self.known_package_id(package))
+            return (self.versions(package), [from_micros(t) for t in self.cols["ver_time"][s:e]])
+        return self.vindex.get(package, index)
+
+    def versionAsOf(self, p, asOfDate):
+        "What version of package p was newest as of some date?"
+        return self.versionsAsOf(p, [asOfDate])[0]
+
+    def versionsAsOf(self, p, asOfDates):
+        """What version of package p was newest as of each of several dates?
+
+        returns a list parallel to asOfDates, with None for dates before p's first version"""
+        (s, e) = self.version_rows(self.known_package_id(p))
+        times = self.cols["ver_time"][s:e]
+        earliest = to_micros(VersionHistories.earliest_date)
+        result = []
+        for i in np.searchsorted(times, [to_micros(d) for d in asOfDates], side="left"):
+            if i == 0 or times[i-1] <= earliest:
+                result.append(None)
+            else:
+                result.append(self.vnames[self.cols["ver_name"][s+i-1]])
+        return result
+
+    def date_of_version(self, package, version):
+        return from_micros(self.cols["ver_time"][self.version_row(self.known_package_id(package), version)])
+
+    def dependency_ids(self, rows):
+        """Sorted ids of the packages depended on by a range of version rows"""
+        (s, e) = rows
+        (es, ee) = (self.cols["ver_estart"][s], self.cols["ver_estart"][e])
+        return np.unique(self.cols["edge_dep"][es:ee])
+
+    def dependencies(self, package):
+        """List all packages that have ever been dependencies of a package"""
+        pid = self.known_package_id(package)
+        return set(self.names[d] for d in self.dependency_ids(self.version_rows(pid)))
+
+    def present_dependencies(self, package):
+        pid = self.known_package_id(package)
+        (s, e) = self.version_rows(pid)
+        if s == e:
+            raise NoVersionsException(package)
+        ids = self.dependency_ids((e-1, e))
+        return [self.names[d] for d in ids if self.cols["pkg_known"][d]]
@@ -0,0 +1,294 @@
+"""Parse version constraints and resolve them against upstream release histories
+
+Each ecosystem has a function turning a version name into a sortable key
+(None if it can't be parsed) and a parser compiling a reference string, as
+found in dv, into a Constraint:
+
+    npm      semver ranges: 1.2.3, ^1.2, ~1.2.3, >=1.0.0 <2, 1.x, 1.0 - 2.0, a || b
+    cran     R DESCRIPTION style: (>= 1.2-3)
+    eclipse  OSGi ranges: [1.0,2.0), and bare versions meaning at least that version
+    generic  comparators or bare minimum versions, comparing the numbers in version names
+
+References that can't be parsed (git URLs, tags) compile to a Constraint
+that nothing satisfies.  The most recently used compiled constraints are
+interned, since the same few reference strings recur across a whole ecosystem.
+"""
+import bisect
+import operator
+import re
+import numpy as np
+from lrucache import LRUCache
+
+OPS = { "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+        "=": operator.eq, "==": operator.eq, "!=": operator.ne }
+
+class Constraint:
+    """A compiled version constraint
+
+    alternatives is a list of (comparators, prereleases): a version key
+    satisfies the constraint if it satisfies every (op, key) comparator of
+    some alternative.  If prerelease is given, it maps a version key to its
+    release key if it is a prerelease (else None); a prerelease then only
+    satisfies an alternative that names a prerelease of that same release.
+    """
+    def __init__(self, text, alternatives, prerelease=None):
+        self.text = text
+        self.alternatives = alternatives
+        self.prerelease = prerelease
+
+    def satisfied_by(self, key):
+        if key is None:
+            return False
+        release = self.prerelease(key) if self.prerelease is not None else None
+        for (comparators, prereleases) in self.alternatives:
+            if release is not None and release not in prereleases:
+                continue
+            if all(OPS[op](key, bound) for (op, bound) in comparators):
+                return True
+        return False
+
+    def __repr__(self):
+        return "Constraint(" + repr(self.text) + ")"
+
+ANY = [([], frozenset())]
+
+# npm (semver)
+
+semver = re.compile(r"^v?(\d+|[xX*])(?:\.(\d+|[xX*]))?(?:\.(\d+|[xX*]))?(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?$")
+RELEASE = (1,)
+LOWEST = (0,)
+
+def prerelease_key(pre):
+    if pre is None:
+        return RELEASE
+    return (0,) + tuple((0, int(x)) if x.isdigit() else (1, x) for x in pre.split("."))
+
+def npm_key(v):
+    m = semver.match(v.strip())
+    if m is None or None in m.group(1, 2, 3) or not all(x.isdigit() for x in m.group(1, 2, 3)):
+        return None
+    return (int(m.group(1)), int(m.group(2)), int(m.group(3)), prerelease_key(m.group(4)))
+
+def npm_prerelease(key):
+    return key[:3] if key[3] != RELEASE else None
+
+def npm_partial(v):
+    """([numbers given], prerelease) of a possibly partial version like 1.2 or 1.x; None if it isn't one"""
+    m = semver.match(v)
+    if m is None:
+        return None
+    parts = []
+    for x in m.group(1, 2, 3):
+        if x is None or not x.isdigit():
+            break
+        parts.append(int(x))
+    return (parts, m.group(4) if len(parts) == 3 else None)
+
+def npm_bound(parts, pre=None):
+    full = parts + [0] * (3 - len(parts))
+    return tuple(full) + (prerelease_key(pre),)
+
+def npm_next(parts, i):
+    """Lowest key above every version starting with parts[:i+1]"""
+    bumped = parts[:i] + [parts[i] + 1]
+    return npm_bound(bumped, None)[:3] + (LOWEST,)
+
+def npm_comparators(op, parts, pre):
+    n = len(parts)
+    if n == 0:
+        return []
+    if op in ("", "="):
+        if n == 3:
+            return [("=", npm_bound(parts, pre))]
+        return [(">=", npm_bound(parts)[:3] + (LOWEST,)), ("<", npm_next(parts, n - 1))]
+    if op in ("~", "~>"):
+        return [(">=", npm_bound(parts, pre) if n == 3 else npm_bound(parts)[:3] + (LOWEST,)),
+                ("<", npm_next(parts, min(n - 1, 1)))]
+    if op == "^":
+        nonzero = [i for i in range(n) if parts[i] != 0]
+        i = nonzero[0] if len(nonzero) > 0 else n - 1
+        return [(">=", npm_bound(parts, pre) if n == 3 else npm_bound(parts)[:3] + (LOWEST,)),
+                ("<", npm_next(parts, i))]
+    if op == ">":
+        return [(">", npm_bound(parts, pre))] if n == 3 else [(">=", npm_next(parts, n - 1))]
+    if op == ">=":
+        return [(">=", npm_bound(parts, pre))]
+    if op == "<":
+        return [("<", npm_bound(parts, pre) if n == 3 else npm_bound(parts)[:3] + (LOWEST,))]
+    if op == "<=":
+        return [("<=", npm_bound(parts, pre))] if n == 3 else [("<", npm_next(parts, n - 1))]
+    raise ValueError(op)
+
+npm_token = re.compile(r"^(<=|>=|<|>|=|~>|~|\^)?(.*)$")
+npm_hyphen = re.compile(r"^(\S+)\s+-\s+(\S+)$")
+
+def parse_npm(text):
+    alternatives = []
+    for alt in text.strip().split("||"):
+        alt = re.sub(r"(<=|>=|<|>|=|~>|~|\^)\s+", r"\1", alt.strip())
+        comparators = []
+        prereleases = set()
+        m = npm_hyphen.match(alt)
+        if m is not None:
+            (lo, hi) = (npm_partial(m.group(1)), npm_partial(m.group(2)))
+            if lo is None or hi is None:
+                return Constraint(text, [])
+            comparators = npm_comparators(">=", *lo) + npm_comparators("<=", *hi)
+            tokens = []
+        else:
+            tokens = alt.split() if alt not in ("", "latest") else []
+        for token in tokens:
+            (op, v) = npm_token.match(token).groups()
+            partial = npm_partial(v)
+            if partial is None:
+                return Constraint(text, [])
+            comparators.extend(npm_comparators(op or "", *partial))
+        for (op, bound) in comparators:
+            if bound[3] not in (RELEASE, LOWEST):
+                prereleases.add(bound[:3])
+        alternatives.append((comparators, frozenset(prereleases)))
+    return Constraint(text, alternatives, npm_prerelease)
+
+# R
+
+def r_key(v):
+    if re.match(r"^\d+([.-]\d+)*$", v.strip()) is None:
+        return None
+    return tuple(int(x) for x in re.split(r"[.-]", v.strip()))
+
+r_comparator = re.compile(r"^(>=|<=|==|=|>|<|!=)?\s*(\S+)$")
+
+def parse_comparators(text, key):
+    """AND of comma-separated comparators like (>= 1.0), a bare version meaning at least that version"""
+    comparators = []
+    for part in text.strip().strip("()").split(","):
+        part = part.strip().strip("()").strip()
+        if part in ("", "*"):
+            continue
+        m = r_comparator.match(part)
+        bound = key(m.group(2)) if m is not None else None
+        if bound is None:
+            return Constraint(text, [])
+        comparators.append((m.group(1) or ">=", bound))
+    return Constraint(text, [(comparators, frozenset())])
+
+def parse_r(text):
+    return parse_comparators(text, r_key)
+
+# OSGi
+
+osgi_version = re.compile(r"^(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:\.([0-9A-Za-z_-]+))?$")
+
+def osgi_key(v):
+    m = osgi_version.match(v.strip())
+    if m is None:
+        return None
+    return tuple(int(x or 0) for x in m.group(1, 2, 3)) + (m.group(4) or "",)
+
+osgi_range = re.compile(r"^([\[(])\s*([^,]*?)\s*,\s*([^\])]*?)\s*([\])])$")
+
+def parse_osgi(text):
+    m = osgi_range.match(text.strip())
+    if m is None:
+        return parse_comparators(text, osgi_key)
+    comparators = []
+    if m.group(2) != "":
+        comparators.append((">=" if m.group(1) == "[" else ">", osgi_key(m.group(2))))
+    if m.group(3) != "":
+        comparators.append(("<=" if m.group(4) == "]" else "<", osgi_key(m.group(3))))
+    if None in [bound for (op, bound) in comparators]:
+        return Constraint(text, [])
+    return Constraint(text, [(comparators, frozenset())])
+
+# anything else
+
+def generic_key(v):
+    numbers = re.findall(r"\d+", v)
+    return tuple(int(x) for x in numbers) if len(numbers) > 0 else None
+
+def parse_generic(text):
+    return parse_comparators(text, generic_key)
+
+ECOSYSTEMS = { "npm": (npm_key, parse_npm),
+               "cran": (r_key, parse_r),
+               "eclipse": (osgi_key, parse_osgi),
+               "generic": (generic_key, parse_generic) }
+
+compiled = LRUCache(100000)
+
+def compile_constraint(ecosystem, text):
+    """Compiled Constraint for a reference string; recently used ones aren't parsed again"""
+    return compiled.get((ecosystem, text), lambda: ECOSYSTEMS[ecosystem][1](text))
+
+class ConstraintResolver:
+    """Find which upstream release each dependency reference actually resolved to
+
+    For each upstream package, its versions are ranked by version key once.
+    For each distinct (upstream, reference) pair, the highest-ranked satisfying
+    version among the first n releases is found for every n at once (a running
+    maximum over the chronological version index), so resolving any number of
+    edges as of any dates costs one bisection each.  The rankings of the
+    upstreams most recently used, and the running maxima of the most recently
+    used pairs, are kept in LRUCaches of at most upstreams and prefixes entries.
+    """
+
+    def __init__(self, vh, ecosystem=None, upstreams=10000, prefixes=100000):
+        self.vh = vh
+        if ecosystem is None:
+            ecosystem = vh.auxdata["ecosystem"] if "ecosystem" in vh.auxdata else "generic"
+        self.ecosystem = ecosystem
+        self.key = ECOSYSTEMS[ecosystem][0]
+        self.upstreams = LRUCache(upstreams)
+        self.prefixes = LRUCache(prefixes)
+
+    def upstream(self, dep):
+        """(dates, keys, rank, by_rank) of dep's versions in chrono order; KeyError if dep is unknown"""
+        def ranking():
+            (vers, dates) = self.vh.version_index(dep)
+            keys = [self.key(v) for v in vers]
+            ranked = sorted((k, i) for (i, k) in enumerate(keys) if k is not None)
+            rank = np.full(len(vers), -1, dtype=np.int32)
+            for (r, (k, i)) in enumerate(ranked):
+                rank[i] = r
+            return (dates, keys, rank, [vers[i] for (k, i) in ranked])
+        return self.upstreams.get(dep, ranking)
+
+    def best(self, dep, text):
+        """best[n]: rank of the highest version among dep's first n releases that satisfies text, or -1"""
+        def running_maximum():
+            (dates, keys, rank, by_rank) = self.upstream(dep)
+            c = compile_constraint(self.ecosystem, text)
+            ok = np.array([c.satisfied_by(k) for k in keys], dtype=bool)
+            return np.concatenate([[-1], np.maximum.accumulate(np.where(ok, rank, -1))]).astype(np.int32)
+        return self.prefixes.get((dep, text), running_maximum)
+
+    def resolve(self, dep, text, asOfDates):
+        """Newest release of dep satisfying reference text, out of those released before each of
+        asOfDates (None if there is none, or dep is unknown)"""
+        try:
+            (dates, keys, rank, by_rank) = self.upstream(dep)
+        except KeyError:
+            return [None] * len(asOfDates)
+        best = self.best(dep, text)
+        result = []
+        for d in asOfDates:
+            r = best[bisect.bisect_left(dates, d)]
+            result.append(by_rank[r] if r >= 0 else None)
+        return result
+
+    def resolve_package(self, package):
+        """{ version: { dep: release of dep it resolved to, or None } } for every version of package
+
+        Each version's references are resolved as of the date it was released."""
+        (vers, dates) = self.vh.version_index(package)
+        pending = {}
+        for (v, date) in zip(vers, dates):
+            deps = self.vh.dv[package][v]
+            for d in deps:
+                text = deps[d][0][1] if len(deps[d]) > 0 else ""
+                pending.setdefault((d, text), []).append((v, date))
+        result = { v: {} for v in vers }
+        for ((d, text), uses) in pending.iteritems():
+            for ((v, date), resolved) in zip(uses, self.resolve(d, text, [date for (v, date) in uses])):
+                result[v][d] = resolved
+        return result
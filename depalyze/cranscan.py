@@ -1,23 +1,161 @@
 import os
 from rscraper import parseDCF, DCFparse2DependencyLists
 import datetime
+import hashlib
+import itertools
 import pytz
+import multiprocessing
 import versionhistory
+import parallel
 
-def scan_R_descriptions(descriptionDir):
-    """Turn cache of DESCRIPTION files from R projects over time into dependency data structure"""
+def read_description(path):
+    """Read one DESCRIPTION file
+
+    returns: (manifest entry [mtime, size, sha1 of contents], contents); see described_versions
+    """
+    st = os.stat(path)
+    with open(path, "r") as f:
+        text = f.read()
+    return ([st.st_mtime, st.st_size, hashlib.sha1(text).hexdigest()], text)
+
+def parse_description(path, text):
+    try:
+        return parseDCF(text)
+    except Exception, e:
+        print "Error reading ", path, e
+        return []
+
+def described_versions(records):
+    """[[package, version]] described by a DESCRIPTION file's parsed records; the fourth
+    element of its manifest entry, so that versions can be dropped when the file is"""
+    return [[r["Package"], r["Version"]] for r in records if "Package" in r and "Version" in r]
+
+def scan_description_tree(descriptionDir, base, recurse=True):
+    """Parse every DESCRIPTION file under descriptionDir
+
+    returns: (manifest of path relative to base -> [mtime, size, sha1, versions], list of parsed DCF records)
+    """
     depstruct = []
+    manifest = dict()
     for root, dirs, files in os.walk(descriptionDir):
-        if len(depstruct) % 500 == 0:
-            print "Reading directory", root
+        if not recurse:
+            del dirs[:]
         for f in files:
             if f == "DESCRIPTION":
-                with open( os.path.join(root,f), "r") as f:
-                    try:
-                        depstruct = depstruct + parseDCF(f.read())
-                    except Exception, e:
-                        print "Error reading ", dirs, "/DESCRIPTION", e
-    (da, dc, dv) = DCFparse2DependencyLists(depstruct)
-    vh = versionhistory.VersionHistories()
-    vh.preload(da, dc, dv, datetime.datetime.now().replace(tzinfo=pytz.UTC))
+                path = os.path.join(root,f)
+                (entry, text) = read_description(path)
+                records = parse_description(path, text)
+                manifest[os.path.relpath(path, base)] = entry + [described_versions(records)]
+                depstruct.extend(records)
+    return (manifest, depstruct)
+
+def scan_description_subtree(job):
+    (descriptionDir, base) = job
+    return scan_description_tree(descriptionDir, base)
+
+def scan_R_descriptions(descriptionDir, processes=None, vh=None):
+    """Turn cache of DESCRIPTION files from R projects over time into dependency data structure
+
+    Each subdirectory of descriptionDir is walked and parsed in a separate worker process;
+    processes: size of the pool (default: number of cpus); 1 scans in this process
+    vh: the VersionHistories (e.g. a SqliteVersionHistories) to load into; default a new one.
+        Each subdirectory's packages are passed to vh.preload_packages as soon as
+        they are parsed, so scanning into a SqliteVersionHistories doesn't hold
+        every package in memory.
+
+    The files read are listed in the "description_manifest" aux data, so that
+    rescan_R_descriptions can later read only the ones that changed.
+    """
+    manifest = dict()
+    def packages():
+        (top_manifest, top) = scan_description_tree(descriptionDir, descriptionDir, recurse=False)
+        jobs = [(os.path.join(descriptionDir, d), descriptionDir) for d in sorted(os.listdir(descriptionDir))
+                       if os.path.isdir(os.path.join(descriptionDir, d))]
+        def read(parts):
+            reported = 0
+            for (part_manifest, part) in itertools.chain([(top_manifest, top)], parts):
+                manifest.update(part_manifest)
+                (da, dc, dv) = DCFparse2DependencyLists(part)
+                for p in dc:
+                    yield (p, da.get(p, ""), dc[p], dv.get(p, {}))
+                if len(manifest) - reported >= 500:
+                    print "Read", len(manifest), "DESCRIPTION files"
+                    reported = len(manifest)
+        if processes == 1:
+            for package in read(scan_description_subtree(job) for job in jobs):
+                yield package
+        else:
+            with parallel.finishing(multiprocessing.Pool(processes)) as pool:
+                for package in read(pool.imap(scan_description_subtree, jobs)):
+                    yield package
+        print "Read", len(manifest), "DESCRIPTION files"
+    if vh is None:
+        vh = versionhistory.VersionHistories()
+    vh.preload_packages(packages(), datetime.datetime.now().replace(tzinfo=pytz.UTC))
+    vh.set_aux("description_manifest", manifest)
+    vh.set_aux("ecosystem", "cran")
     return vh
+
+def rescan_R_descriptions(vh, descriptionDir):
+    """Update vh from a cache of DESCRIPTION files, reading only files that are new or changed
+
+    A file is skipped if its mtime and size match the "description_manifest" aux data
+    recorded by the previous scan, or if its contents hash the same.  Versions found in
+    the remaining files are merged into the existing histories; versions that were only
+    described by files since deleted (or changed) are removed, and so are packages left
+    with no versions.
+
+    returns: the number of DESCRIPTION files parsed
+    """
+    previous = vh.get_aux("description_manifest") if "description_manifest" in vh.auxdata else {}
+    manifest = {}
+    depstruct = []
+    nparsed = 0
+    for root, dirs, files in os.walk(descriptionDir):
+        for f in files:
+            if f == "DESCRIPTION":
+                path = os.path.join(root,f)
+                rel = os.path.relpath(path, descriptionDir)
+                old = previous.get(rel)
+                st = os.stat(path)
+                if old is not None and old[0] == st.st_mtime and old[1] == st.st_size:
+                    manifest[rel] = old
+                    continue
+                (entry, text) = read_description(path)
+                if old is not None and old[2] == entry[2]:
+                    manifest[rel] = entry + old[3:]
+                    continue
+                nparsed += 1
+                records = parse_description(path, text)
+                manifest[rel] = entry + [described_versions(records)]
+                depstruct.extend(records)
+    print "Read", nparsed, "new or changed DESCRIPTION files"
+    remove_undescribed_versions(vh, previous, manifest)
+    (da, dc, dv) = DCFparse2DependencyLists(depstruct)
+    for p in dc:
+        pdc = dict(vh.dc.get(p, {}))
+        pdc.update(dc[p])
+        pdv = dict(vh.dv.get(p, {}))
+        pdv.update(dv.get(p, {}))
+        vh.update_package(p, da.get(p, vh.author(p)), pdc, pdv)
+    vh.set_aux("description_manifest", manifest)
+    vh.set_end_of_time(datetime.datetime.now().replace(tzinfo=pytz.UTC))
+    return nparsed
+
+def remove_undescribed_versions(vh, previous, manifest):
+    """Remove from vh the versions that files in the previous manifest described, but no file
+    in the current one does (e.g. because their DESCRIPTION files were deleted)"""
+    def versions(m):
+        return set((p, v) for entry in m.itervalues() for (p, v) in (entry[3] if len(entry) > 3 else []))
+    gone = {}
+    for (p, v) in versions(previous) - versions(manifest):
+        gone.setdefault(p, set()).add(v)
+    for p in gone:
+        if p not in vh.dv:
+            continue
+        pdc = dict((v, d) for (v, d) in vh.dc[p].iteritems() if v not in gone[p])
+        if len(pdc) == 0:
+            vh.remove_package(p)
+        else:
+            pdv = dict((v, deps) for (v, deps) in vh.dv[p].iteritems() if v not in gone[p])
+            vh.update_package(p, vh.author(p), pdc, pdv)
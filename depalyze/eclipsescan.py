@@ -3,75 +3,190 @@ import re
 import datetime
 import pytz
 import datetime
+import multiprocessing
 import versionhistory
+import parallel
 from collections import defaultdict
 from lxml import objectify
 
 repo_comment = re.compile("<!-- ## (.*?)/(.*?) ## -->")
 
-def scan_eclipse_xml(fname, sample = False):
-    kidtypes = ["req", "extensionPoint", "extension"]
-    ver_changes = dict()
-    ver_deps = dict()
-    ver_auth = dict()
-    bundle2project = defaultdict(set)
-    bundle2repo = defaultdict(set)
-    bundle2projrepo = defaultdict(set)
+def new_eclipse_scan():
+    """Empty accumulator for the results of scanning bundle dependency xml"""
+    return {"ver_changes": dict(),
+            "ver_deps": dict(),
+            "ver_auth": dict(),
+            "bundle2project": defaultdict(set),
+            "bundle2repo": defaultdict(set),
+            "bundle2projrepo": defaultdict(set),
+            "errors": 0}
+
+def new_eclipse_chunk_scan():
+    """Empty accumulator for one chunk of a file.
+
+    Also records every accepted (date, dependencies) occurrence of each bundle version,
+    so that chunks can be merged exactly as if the file had been scanned in sequence.
+    """
+    scan = new_eclipse_scan()
+    scan["occurrences"] = defaultdict(list)
+    return scan
+
+def scan_eclipse_lines(lines, scan, sample = False, verbose = True):
+    """Add each bundle described in lines to scan; return scan"""
+    ver_changes = scan["ver_changes"]
+    ver_deps = scan["ver_deps"]
+    ver_auth = scan["ver_auth"]
+    bundle2project = scan["bundle2project"]
+    bundle2repo = scan["bundle2repo"]
+    bundle2projrepo = scan["bundle2projrepo"]
     rowcount = 0
     project = ""
     repo = ""
     projrepo = "/"
-    with open(fname,"r") as f:
-        for line in f.readlines():
-            if len(line) > 2:
-                rowcount = rowcount + 1
-                if sample and rowcount > 20:
-                    break
-                if "##" in line:
-                   projinfo = repo_comment.match(line)
-                   if projinfo:
-                      project = projinfo.group(1)
-                      repo = projinfo.group(2)
-                      projrepo = project + "/" + repo
+    for line in lines:
+        if len(line) > 2:
+            rowcount = rowcount + 1
+            if sample and rowcount > 20:
+                break
+            if "##" in line:
+               projinfo = repo_comment.match(line)
+               if projinfo:
+                  project = projinfo.group(1)
+                  repo = projinfo.group(2)
+                  projrepo = project + "/" + repo
+                  if verbose:
                       print "FOUND: ", projrepo
-                      continue
-                try:
-                   xmldoc = objectify.fromstring(line.strip())
-                   focal = xmldoc.bundle.attrib["name"]
-                   if projrepo != "":
-                       bundle2project[focal].add(project)
-                       bundle2repo[focal].add(repo)
-                       bundle2projrepo[focal].add(projrepo)
-                   if len(focal) == 0: raise ValueError("Empty bundle name; skipping")
-                   focal_ver = xmldoc.bundle.attrib["version"]
-                   focal_ver_date = datetime.datetime.fromtimestamp(float(xmldoc.attrib["date"]))
-                   if focal not in ver_changes:
-                       ver_changes[focal] = dict()
-                       ver_auth[focal] = ".".join(focal.split(".")[:3])
-                   if focal not in ver_deps:
-                       ver_deps[focal] = dict()
-                   if focal_ver not in ver_changes[focal] or ver_changes[focal][focal_ver] < focal_ver_date:
-                       ver_changes[focal][focal_ver] = focal_ver_date
-                       if focal_ver not in ver_deps[focal]: ver_deps[focal][focal_ver] = dict()
-                       for ch in xmldoc.bundle.iterchildren():
-                           if ch.text is None or len(ch.text) == 0:
-                               continue
-                           if ch.text not in ver_deps[focal][focal_ver]:
-                               ver_deps[focal][focal_ver][ch.text] = []
-                           if "v" in ch.attrib:
-                               ver_deps[focal][focal_ver][ch.text].append((ch.tag, ch.attrib["v"]))
-                           elif "bundle-version" in ch.attrib:
-                               ver_deps[focal][focal_ver][ch.text].append((ch.tag, ch.attrib["bundle-version"]) )
-                           else:
-                               ver_deps[focal][focal_ver][ch.text].append((ch.tag, ""))
-                except Exception, e:
+                  continue
+            try:
+               xmldoc = objectify.fromstring(line.strip())
+               focal = xmldoc.bundle.attrib["name"]
+               if projrepo != "":
+                   bundle2project[focal].add(project)
+                   bundle2repo[focal].add(repo)
+                   bundle2projrepo[focal].add(projrepo)
+               if len(focal) == 0: raise ValueError("Empty bundle name; skipping")
+               focal_ver = xmldoc.bundle.attrib["version"]
+               focal_ver_date = datetime.datetime.fromtimestamp(float(xmldoc.attrib["date"]))
+               if focal not in ver_changes:
+                   ver_changes[focal] = dict()
+                   ver_auth[focal] = ".".join(focal.split(".")[:3])
+               if focal not in ver_deps:
+                   ver_deps[focal] = dict()
+               if focal_ver not in ver_changes[focal] or ver_changes[focal][focal_ver] < focal_ver_date:
+                   ver_changes[focal][focal_ver] = focal_ver_date
+                   if focal_ver not in ver_deps[focal]: ver_deps[focal][focal_ver] = dict()
+                   added = []
+                   for ch in xmldoc.bundle.iterchildren():
+                       if ch.text is None or len(ch.text) == 0:
+                           continue
+                       if ch.text not in ver_deps[focal][focal_ver]:
+                           ver_deps[focal][focal_ver][ch.text] = []
+                       if "v" in ch.attrib:
+                           ref = (ch.tag, ch.attrib["v"])
+                       elif "bundle-version" in ch.attrib:
+                           ref = (ch.tag, ch.attrib["bundle-version"])
+                       else:
+                           ref = (ch.tag, "")
+                       ver_deps[focal][focal_ver][ch.text].append(ref)
+                       added.append((ch.text, ref))
+                   if "occurrences" in scan:
+                       scan["occurrences"][(focal, focal_ver)].append((focal_ver_date, added))
+            except Exception, e:
+               scan["errors"] += 1
+               if verbose:
                    print line, e
-    vh = versionhistory.VersionHistories()
-    vh.preload(ver_auth, ver_changes, ver_deps, datetime.datetime.now().replace(tzinfo=pytz.UTC))
-    
-    vh.set_aux("bundle2project", { bundle: list(bundle2project[bundle]) for bundle in bundle2project} )
-    vh.set_aux("bundle2repo", { bundle: list(bundle2repo[bundle]) for bundle in bundle2repo} )
-    vh.set_aux("bundle2projrepo", { bundle: list(bundle2projrepo[bundle]) for bundle in bundle2projrepo} )
-    return vh
+    return scan
+
+def merge_eclipse_scan(scan, part):
+    """Merge the results of scanning one chunk (see new_eclipse_chunk_scan) into scan.
+
+    Chunks must be merged in file order.  As within a chunk, an occurrence of a bundle
+    version is kept only if it is later than any seen before, and its dependencies are
+    added to those already recorded for that version.
+    """
+    for focal in part["ver_changes"]:
+        if focal not in scan["ver_changes"]:
+            scan["ver_changes"][focal] = dict()
+            scan["ver_auth"][focal] = part["ver_auth"][focal]
+            scan["ver_deps"][focal] = dict()
+    for ((focal, focal_ver), occurrences) in part["occurrences"].iteritems():
+        changes = scan["ver_changes"][focal]
+        for (focal_ver_date, added) in occurrences:
+            if focal_ver not in changes or changes[focal_ver] < focal_ver_date:
+                changes[focal_ver] = focal_ver_date
+                deps = scan["ver_deps"][focal].setdefault(focal_ver, dict())
+                for (dep, ref) in added:
+                    deps.setdefault(dep, []).append(ref)
+    for key in ["bundle2project", "bundle2repo", "bundle2projrepo"]:
+        for bundle in part[key]:
+            scan[key][bundle].update(part[key][bundle])
+    scan["errors"] += part["errors"]
+    return scan
 
+def eclipse_chunks(fname, chunk_bytes):
+    """Split fname into (start, end) byte ranges of about chunk_bytes each.
 
+    Every range but the first starts at a <!-- ## project/repo ## --> line, so that
+    each chunk can be scanned knowing which project its bundles come from.
+    """
+    size = os.path.getsize(fname)
+    starts = [0]
+    with open(fname, "rb") as f:
+        target = chunk_bytes
+        while target < size:
+            f.seek(target)
+            f.readline()
+            pos = f.tell()
+            line = f.readline()
+            while line and not repo_comment.match(line):
+                pos = f.tell()
+                line = f.readline()
+            if not line:
+                break
+            if pos > starts[-1]:
+                starts.append(pos)
+            target = max(pos, target) + chunk_bytes
+    return zip(starts, starts[1:] + [size])
+
+def scan_eclipse_chunk(job):
+    """Scan the bundles in byte range [start, end) of fname"""
+    (fname, start, end) = job
+    def lines():
+        with open(fname, "rb") as f:
+            f.seek(start)
+            pos = start
+            while pos < end:
+                line = f.readline()
+                if not line:
+                    break
+                pos += len(line)
+                yield line
+    return scan_eclipse_lines(lines(), new_eclipse_chunk_scan(), verbose = False)
+
+def scan_eclipse_xml(fname, sample = False, processes = None, chunk_bytes = None, vh = None):
+    """Read a file of bundle dependency xml (one bundle per line) into a VersionHistories
+
+    chunk_bytes: if given, split the file into chunks of about this many bytes at
+        project/repo boundaries, and scan them in a pool of processes worker processes
+        (default: number of cpus).  Lines that fail to parse are counted, not printed.
+    vh: the VersionHistories (e.g. a SqliteVersionHistories) to load into; default a new one
+    """
+    if chunk_bytes is None or sample:
+        with open(fname,"r") as f:
+            scan = scan_eclipse_lines(f, new_eclipse_scan(), sample = sample)
+    else:
+        scan = new_eclipse_scan()
+        jobs = [(fname, start, end) for (start, end) in eclipse_chunks(fname, chunk_bytes)]
+        with parallel.finishing(multiprocessing.Pool(processes)) as pool:
+            for part in pool.imap(scan_eclipse_chunk, jobs):
+                merge_eclipse_scan(scan, part)
+        print "Scanned", len(jobs), "chunks;", scan["errors"], "lines could not be parsed"
+    if vh is None:
+        vh = versionhistory.VersionHistories()
+    vh.preload(scan["ver_auth"], scan["ver_changes"], scan["ver_deps"], datetime.datetime.now().replace(tzinfo=pytz.UTC))
+    vh.set_aux("ecosystem", "eclipse")
+
+    vh.set_aux("bundle2project", { bundle: list(scan["bundle2project"][bundle]) for bundle in scan["bundle2project"]} )
+    vh.set_aux("bundle2repo", { bundle: list(scan["bundle2repo"][bundle]) for bundle in scan["bundle2repo"]} )
+    vh.set_aux("bundle2projrepo", { bundle: list(scan["bundle2projrepo"][bundle]) for bundle in scan["bundle2projrepo"]} )
+    return vh
@@ -0,0 +1,26 @@
+from collections import OrderedDict
+
+class LRUCache:
+    """Bounded memo: remembers the values of the maxsize most recently used keys"""
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+
+    def get(self, key, compute):
+        """Value remembered for key, or compute() if there is none"""
+        if key in self.items:
+            value = self.items.pop(key)
+        else:
+            value = compute()
+            if len(self.items) >= self.maxsize:
+                self.items.popitem(last=False)
+        self.items[key] = value
+        return value
+
+    def discard(self, key):
+        self.items.pop(key, None)
+
+    def clear(self):
+        self.items.clear()
+
+    def __len__(self): return len(self.items)
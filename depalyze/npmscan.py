@@ -16,36 +16,109 @@ def extract_author(row):
     except:
         return ""
 
-    
-def scan_npm_json(fname):
+def scan_npm_row(row, da, dc, dv):
+    """Add one row of an _all_docs dump (one package document) to da, dc, and dv"""
+    p = row["key"]
+    if "time" not in row["doc"] or \
+         ("unpublished" in row["doc"]["time"] and \
+          "versions" not in row["doc"]["time"]):
+        return
+    try:
+        da[p] = extract_author(row)
+        dc[p] = { v : dateutil.parser.parse(row["doc"]["time"][v]) for v in row["doc"]["versions"] }
+        dv[p] = { v : dict() for v in row["doc"]["versions"] }
+        for t in row["doc"]["versions"]:
+            for deptype in ["dependencies"]:
+                for dep in row["doc"]["versions"][t].get(deptype, []):
+                    if dep not in dv[p][t]:
+                        dv[p][t][dep] = []
+                    dv[p][t][dep].append((deptype, row["doc"]["versions"][t][deptype][dep]))
+    except Exception, e:
+        print "Skipping ",p,"because",e
+        #import pdb
+        #pdb.set_trace()
+
+def npm_packages(rows):
+    """Yield (package, author, dc, dv) for each package document in rows that scan_npm_row can read"""
+    for row in rows:
+        (da, dc, dv) = (dict(), dict(), dict())
+        scan_npm_row(row, da, dc, dv)
+        for p in dc:
+            yield (p, da[p], dc[p], dv[p])
+
+def npm_rows(f):
+    """Yield the rows of an _all_docs dump one at a time, without loading the whole file
+
+    Uses the ijson incremental parser, so only one package document is in memory at a time.
+    """
+    import ijson
+    for row in ijson.items(f, "rows.item"):
+        yield row
+
+def scan_npm_json(fname, stream=False, vh=None):
+    """Read an _all_docs?include_docs=true dump of the NPM registry into a VersionHistories
+
+    stream: parse rows incrementally rather than loading the whole dump at once,
+            so peak memory depends on the largest package document rather than
+            the size of the registry.  Requires ijson.
+    vh: the VersionHistories (e.g. a SqliteVersionHistories) to load into; default a new one.
+            Packages are passed to vh.preload_packages as they are read, so
+            streaming into a SqliteVersionHistories never holds the whole
+            registry in memory.
+    """
+    if vh is None:
+        vh = versionhistory.VersionHistories()
     with open(fname, "r") as f:
-        npms = json.load(f)
-    da = dict()
-    dc = dict()
-    dv = dict()
-    for row in npms["rows"]:
-        p = row["key"]
-        if "time" not in row["doc"] or \
-             ("unpublished" in row["doc"]["time"] and \
-              "versions" not in row["doc"]["time"]):
-            continue
-        try:
-            da[p] = extract_author(row)
-            dc[p] = { v : dateutil.parser.parse(row["doc"]["time"][v]) for v in row["doc"]["versions"] }
-            dv[p] = { v : dict() for v in row["doc"]["versions"] }
-            for t in row["doc"]["versions"]:
-                for deptype in ["dependencies"]:
-                    for dep in row["doc"]["versions"][t].get(deptype, []):
-                        if dep not in dv[p][t]:
-                            dv[p][t][dep] = []
-                        dv[p][t][dep].append((deptype, row["doc"]["versions"][t][deptype][dep]))
-        except Exception, e:
-            print "Skipping ",p,"because",e
-            #import pdb
-            #pdb.set_trace()
-
-    vh = versionhistory.VersionHistories()
-    vh.preload(da, dc, dv, datetime.datetime.now().replace(tzinfo=pytz.UTC))
+        if stream:
+            rows = npm_rows(f)
+        else:
+            rows = json.load(f)["rows"]
+        vh.preload_packages(npm_packages(rows), datetime.datetime.now().replace(tzinfo=pytz.UTC))
+    vh.set_aux("ecosystem", "npm")
     return vh
 
+def npm_changes(f):
+    """Yield the change records of a _changes?include_docs=true feed saved one JSON object per line"""
+    for line in f:
+        line = line.strip().rstrip(",")
+        if line.startswith("{") and not line.startswith('{"results"'):
+            yield json.loads(line)
 
+def apply_npm_changes(vh, changes):
+    """Bring vh up to date by applying a sequence of CouchDB-style change records
+
+    Only packages named in a change are re-read; the sequence number of the
+    last change applied is kept in vh's "npm_last_seq" aux data, to know where
+    to resume the feed next time.
+
+    returns: the number of packages updated or removed
+    """
+    count = 0
+    seq = None
+    for change in changes:
+        if "last_seq" in change and "id" not in change:
+            seq = change["last_seq"]
+            continue
+        seq = change.get("seq", seq)
+        p = change["id"]
+        if p.startswith("_design/"):
+            continue
+        da = dict()
+        dc = dict()
+        dv = dict()
+        if not change.get("deleted", False) and "doc" in change:
+            scan_npm_row({"key": p, "doc": change["doc"]}, da, dc, dv)
+        if p in dc:
+            vh.update_package(p, da[p], dc[p], dv[p])
+        else:
+            vh.remove_package(p)
+        count += 1
+    if seq is not None:
+        vh.set_aux("npm_last_seq", seq)
+    vh.set_end_of_time(datetime.datetime.now().replace(tzinfo=pytz.UTC))
+    return count
+
+def update_npm_json(vh, fname):
+    """Apply a saved _changes feed (see npm_changes) to vh; returns the number of packages touched"""
+    with open(fname, "r") as f:
+        return apply_npm_changes(vh, npm_changes(f))
@@ -0,0 +1,82 @@
+"""Run VersionHistories queries in a pool of forked worker processes
+
+The VersionHistories is left in a module global before the pool is created,
+so forked workers inherit it, sharing its pages copy-on-write, instead of
+having it pickled to them.  Use forked_pool, which forgets it again once the
+pool is finished.
+"""
+import contextlib
+import multiprocessing
+
+shared = None
+
+def fork_pool(vh, processes=None, initializer=None):
+    """Pool of processes (default: number of cpus) whose workers can all read vh as parallel.shared
+
+    initializer: if given, each worker also calls it once when it starts"""
+    global shared
+    shared = vh
+    return multiprocessing.Pool(processes, initializer=worker_started, initargs=(initializer,))
+
+@contextlib.contextmanager
+def finishing(pool):
+    """Close and join pool after the with block, or terminate it if the block raises"""
+    try:
+        yield pool
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+@contextlib.contextmanager
+def forked_pool(vh, processes=None, initializer=None):
+    """fork_pool(vh, processes, initializer) for the length of a with block; finished as by
+    finishing, after which parallel.shared no longer keeps vh alive"""
+    global shared
+    try:
+        with finishing(fork_pool(vh, processes, initializer)) as pool:
+            yield pool
+    finally:
+        shared = None
+
+def worker_started(initializer=None):
+    shared.after_fork()
+    if initializer is not None:
+        initializer()
+
+def shards(items, shard_size):
+    return [items[i:i+shard_size] for i in range(0, len(items), shard_size)]
+
+def reverse_dependency_shard(packages):
+    return shared.reverse_dependencies_of(packages)
+
+def build_reverse_dependencies(vh, processes=None, shard_size=1000):
+    """Yield vh.reverse_dependencies_of for shards of vh's packages, computed in a pool of processes"""
+    with forked_pool(vh, processes) as pool:
+        for part in pool.imap_unordered(reverse_dependency_shard, shards(list(vh.packages()), shard_size)):
+            yield part
+
+def screen_shard(job):
+    (criterion, packages) = job
+    results = []
+    for p in packages:
+        try:
+            results.append((p, getattr(shared, criterion)(p), None))
+        except Exception, e:
+            results.append((p, None, e))
+    return results
+
+def screen(vh, criterion, packages, processes=None, chunksize=100, ordered=True):
+    """Yield (package, vh.<criterion>(package), exception or None) for each of packages
+
+    Chunks of chunksize packages are evaluated in a pool of processes workers;
+    results come back in package order if ordered, else as chunks finish.
+    """
+    with forked_pool(vh, processes) as pool:
+        mapper = pool.imap if ordered else pool.imap_unordered
+        for part in mapper(screen_shard, [(criterion, shard) for shard in shards(packages, chunksize)]):
+            for result in part:
+                yield result
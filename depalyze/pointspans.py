@@ -6,32 +6,35 @@ class PointSpans:
     the same name"""
     def __init__(self):
         self.points = []
+        self.ordered = True
 
     def addchange(self, name, changetime):
         assert type(changetime) is datetime.datetime, \
               "called addchange with type" + str(type(changetime)) + " " + str(changetime)
+        if len(self.points) > 0 and changetime < self.points[-1][1]:
+            self.ordered = False
         self.points.append((name, changetime))
 
     def foreach(self, endtime):
         assert type(endtime) is datetime.datetime, \
               "called foreach with type" + str(type(endtime)) + " " + str(endtime)
         self.merge()
-        spans = sorted(self.points, key=lambda (n,t): t)
-        for (s,e) in zip(spans, spans[1:] + [("", endtime)]):
+        for (s,e) in zip(self.points, self.points[1:] + [("", endtime)]):
             if (e[1]>s[1] and s[0] != None):
                 yield (s[0], s[1], e[1])
 
     def merge(self):
-        from inspect import getouterframes, currentframe
-        def mergerec(items):
-            if (len(items) < 2):
-                return items
-            rest = mergerec(items[1:])
-            if len(rest) and items[0][0] == rest[0][0]:
-                return [items[0]] + rest[1:]
-            else:
-                return [items[0]] + rest
-        self.points = mergerec(self.points)
+        """Put the points in time order, then drop each one with the same name as the one before it
+
+        Changes are usually added in time order, so this normally doesn't need to sort at all."""
+        if not self.ordered:
+            self.points.sort(key=lambda (n,t): t)
+            self.ordered = True
+        merged = []
+        for point in self.points:
+            if len(merged) == 0 or merged[-1][0] != point[0]:
+                merged.append(point)
+        self.points = merged
 
     def test(self):
         a = PointSpans()
@@ -46,5 +49,3 @@ class PointSpans:
         a.addchange("a", d9)
 
         assert list(a.foreach(d11)) == [("a",d3,d7),("b",d7,d9),("a",d9,d11)], str(a.foreach(d11))
-
-PointSpans().test()
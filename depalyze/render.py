@@ -0,0 +1,192 @@
+"""Render the text timeline and dependency graphs of many packages, headless and in parallel
+
+Each package gets three outputs in the plots directory: p.timeline.txt,
+p.svg (upstream dependencies) and p.down.svg (downstream dependencies).
+Every output is written to a temporary file beside it and renamed into
+place, so an interrupted run never leaves a partial file under an output's
+name.
+
+p.digests.json records, for each output, a digest of everything it was drawn
+from: the versions and dates of p and of the packages around it, the
+dependency version spans linking them, their authors, and end_of_time.  An
+output is only drawn again when its digest changes, so after an incremental
+update only the plots of the packages it touched are redrawn.  Refreshes
+advance end_of_time to the present, which only stretches the last span of
+each bar, so end_of_time is digested at the granularity a plot can show (see
+horizon); a refresh that touches nothing leaves every digest as it was.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import parallel
+
+OUTPUTS = [("timeline", ".timeline.txt"), ("deps", ".svg"), ("downstreams", ".down.svg")]
+
+def use_agg():
+    """Worker initializer: draw with the non-interactive Agg backend in this worker process"""
+    from matplotlib import pyplot
+    pyplot.switch_backend("agg")
+
+def output_paths(plots, p):
+    return { kind: os.path.join(plots, p + ext) for (kind, ext) in OUTPUTS }
+
+def digests_path(plots, p):
+    return os.path.join(plots, p + ".digests.json")
+
+def digest(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str)).hexdigest()
+
+def history(vh, p):
+    """(versions, dates, author) of p, or None if it is unknown"""
+    try:
+        (vers, dates) = vh.version_index(p)
+    except KeyError:
+        return None
+    return (vers, dates, vh.author(p))
+
+def horizon(vh, p, resolution=100):
+    """vh.end_of_time as a day number, rounded down to a power of two days that is at most
+    1/resolution of p's history (but at least one day)
+
+    The plots of p stretch from its first release to end_of_time, so while
+    end_of_time stays within one of these buckets the end of the axis moves by
+    less than 1/resolution of its width.  The bucket size only changes when p's
+    history doubles in length.
+    """
+    day = vh.end_of_time.toordinal()
+    h = history(vh, p)
+    days = day - h[1][0].toordinal() if h is not None and len(h[1]) > 0 else 0
+    width = 1 << max(0, (days // resolution).bit_length() - 1)
+    return day - day % width
+
+def open_ended(vh, spans):
+    """[(versionrefstring, start, end)] with the ends at end_of_time, which a refresh moves, as None"""
+    return [(k, st, None if en == vh.end_of_time else en) for (k, st, en) in spans]
+
+def input_digests(vh, p, colwidth=20):
+    """{ output kind: digest of everything drawing that output of p reads }
+
+    The text timeline shows no end dates, and the plots show end_of_time only
+    as the horizon of p."""
+    focal = (p, history(vh, p))
+    upstreams = [(d, history(vh, d)) for d in sorted(vh.dependencies(p))]
+    spans = sorted((d, open_ended(vh, s)) for (d, s) in vh.all_dep_version_spans(p).items())
+    downstreams = vh.rdeptimes[p]
+    return { "timeline": digest(focal, colwidth, upstreams, spans,
+                                [(r, history(vh, r), open_ended(vh, downstreams[r])) for r in sorted(downstreams)]),
+             "deps": digest(focal, horizon(vh, p), vh.constraint_resolver().ecosystem, upstreams, spans),
+             "downstreams": digest(focal, horizon(vh, p), vh.constraint_resolver().ecosystem,
+                                   [(r, history(vh, r), open_ended(vh, vh.dep_version_spans(r, p)),
+                                     vh.dep_versions(r, p))
+                                    for r in list(vh.reverse_dependencies(p))[:20]]) }
+
+def read_digests(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+def write_digests(path, digests):
+    def write(f):
+        with open(f, "w") as out:
+            json.dump(digests, out, sort_keys=True)
+    write_atomically(path, write)
+
+def write_atomically(path, write):
+    """Call write(tempname) to write a file beside path, then rename it to path"""
+    (directory, name) = os.path.split(path)
+    (fd, temp) = tempfile.mkstemp(prefix="." + name + ".", suffix=os.path.splitext(name)[1], dir=directory or ".")
+    os.close(fd)
+    try:
+        write(temp)
+        os.chmod(temp, 0o644)
+        os.rename(temp, path)
+    except:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+def render_package(vh, plots, p, colwidth=20, force=False):
+    """Write those of p's outputs into the plots directory whose inputs changed since they
+    were drawn (all of them, if force)
+
+    returns: "rendered", or "skipped" if every output was reused; drawing errors are raised"""
+    if len(vh.rdepscache) == 0:
+        vh.buildReverseDependencies()
+    paths = output_paths(plots, p)
+    draw = { "timeline": lambda f: vh.showTimeline(p, colwidth=colwidth, file=f),
+             "deps": lambda f: vh.graph_package_deps(p, f, strict=True),
+             "downstreams": lambda f: vh.graph_package_downstreams(p, f, strict=True) }
+    current = input_digests(vh, p, colwidth)
+    recorded = read_digests(digests_path(plots, p))
+    record = dict(recorded)
+    drawn = False
+    try:
+        for (kind, ext) in OUTPUTS:
+            if force or recorded.get(kind) != current[kind] or not os.path.exists(paths[kind]):
+                write_atomically(paths[kind], draw[kind])
+                record[kind] = current[kind]
+                drawn = True
+    finally:
+        if record != recorded:
+            write_digests(digests_path(plots, p), record)
+    return "rendered" if drawn else "skipped"
+
+def render_job(job, vh=None):
+    (plots, p, colwidth, force) = job
+    start = time.time()
+    try:
+        status = render_package(vh or parallel.shared, plots, p, colwidth, force)
+        return (p, status, time.time() - start, None)
+    except Exception, e:
+        return (p, "failed", time.time() - start, type(e).__name__ + ": " + str(e))
+
+def interruptible(results):
+    """Iterate over pool results; a plain next() on them can't be interrupted by Ctrl-C in Python 2"""
+    while True:
+        try:
+            yield results.next(3600)
+        except multiprocessing.TimeoutError:
+            continue
+        except StopIteration:
+            return
+
+def tally(vh, summary, results):
+    """Add each (package, status, seconds, error) of results to a render_packages summary"""
+    for (p, status, seconds, error) in results:
+        summary["seconds"][p] = seconds
+        if status == "failed":
+            summary["failed"][p] = error
+            vh.logwith("Failed to render", p, ":", error)
+        else:
+            summary[status].append(p)
+            vh.logwith(status.capitalize(), p, "in %.1f seconds" % seconds)
+
+def render_packages(vh, plots, packages, processes=None, colwidth=20, force=False):
+    """Render the outputs of each of packages (see render_package) in a pool of processes headless workers
+
+    processes: number of worker processes (None: number of cpus), which draw with the Agg
+        backend; 1 renders in this process, with whatever backend it is using
+    force: redraw every output, even those whose inputs haven't changed
+    returns: summary { "rendered": [packages], "skipped": [packages], "failed": { package: error },
+                       "seconds": { package: rendering time } }
+    """
+    if not os.path.isdir(plots):
+        os.makedirs(plots)
+    if len(vh.rdepscache) == 0:
+        vh.buildReverseDependencies(processes)
+    jobs = [(plots, p, colwidth, force) for p in packages]
+    summary = { "rendered": [], "skipped": [], "failed": {}, "seconds": {} }
+    start = time.time()
+    if processes == 1:
+        tally(vh, summary, (render_job(job, vh) for job in jobs))
+    else:
+        with parallel.forked_pool(vh, processes, initializer=use_agg) as pool:
+            tally(vh, summary, interruptible(pool.imap_unordered(render_job, jobs)))
+    vh.logwith("Rendered", len(summary["rendered"]), "packages, skipped", len(summary["skipped"]),
+               "unchanged ones, and failed on", len(summary["failed"]), "in %.1f seconds" % (time.time() - start))
+    return summary
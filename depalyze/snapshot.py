@@ -0,0 +1,114 @@
+"""Binary snapshots of a VersionHistories, opened with mmap
+
+Layout of a snapshot file:
+
+   8 bytes   MAGIC
+   4 bytes   format version (little-endian uint32)
+   8 bytes   header length (little-endian uint64)
+   header    utf-8 JSON: end of time, aux data, and the dtype, offset and
+             length of every column, relative to the start of the data
+   data      the columns of a CompactVersionHistories, each 8-byte aligned
+
+String pools are stored as two columns: the utf-8 strings concatenated, and
+an int64 array of offsets into them.  Opening a snapshot reads only the
+header; columns are mapped copy-on-write and paged in as they are used.
+"""
+import json
+import mmap
+import struct
+import numpy as np
+from compacthistory import CompactVersionHistories, to_micros, from_micros, utf8
+
+MAGIC = "DEPALYZE"
+FORMAT_VERSION = 1
+POOLS = ["names", "authors", "vnames", "tags", "constraints"]
+
+class MappedStringPool:
+    """StringPool whose strings stay in a mapped snapshot until asked for"""
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i+1]].tostring().decode("utf-8")
+
+    def __len__(self): return len(self.offsets) - 1
+
+    def id(self, s):
+        """id of s, or -1 if it is not in the pool; strings are in utf-8 order, so bisect"""
+        key = utf8(s)
+        (lo, hi) = (0, len(self))
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.blob[self.offsets[mid]:self.offsets[mid+1]].tostring() < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.blob[self.offsets[lo]:self.offsets[lo+1]].tostring() == key:
+            return lo
+        return -1
+
+    @property
+    def strings(self):
+        for i in range(len(self)):
+            yield self[i]
+
+def pool_columns(pool):
+    """(blob, offsets) arrays for a string pool"""
+    encoded = [utf8(s) for s in pool.strings]
+    offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    return (np.array(bytearray("".join(encoded)), dtype=np.uint8), offsets)
+
+def write_snapshot(vh, fname):
+    """Write vh, with its reverse dependency index, to a snapshot file"""
+    if len(vh.rdepscache) == 0:
+        vh.buildReverseDependencies()
+    if not isinstance(vh, CompactVersionHistories):
+        rdeptimes = vh.rdeptimes
+        vh = CompactVersionHistories.compact(vh)
+        vh.build_reverse(rdeptimes)
+    cols = dict(vh.cols)
+    for pool in POOLS:
+        (cols[pool + "_blob"], cols[pool + "_offsets"]) = pool_columns(getattr(vh, pool))
+    layout = {}
+    offset = 0
+    for name in sorted(cols):
+        layout[name] = {"dtype": cols[name].dtype.str, "offset": offset, "length": len(cols[name])}
+        offset += (cols[name].nbytes + 7) // 8 * 8
+    header = json.dumps({"eot": to_micros(vh.end_of_time), "aux": vh.auxdata, "columns": layout})
+    with open(fname, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<IQ", FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write("\0" * (-f.tell() % 8))
+        for name in sorted(cols):
+            f.write(cols[name].tostring())
+            f.write("\0" * (-cols[name].nbytes % 8))
+
+def open_snapshot(fname):
+    """CompactVersionHistories backed by a snapshot file written by write_snapshot"""
+    with open(fname, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(fname + " is not a depalyze snapshot")
+        (version, header_len) = struct.unpack("<IQ", f.read(12))
+        if version != FORMAT_VERSION:
+            raise ValueError(fname + " is snapshot format " + str(version) + "; expected " + str(FORMAT_VERSION))
+        header = json.loads(f.read(header_len))
+        start = f.tell() + (-f.tell() % 8)
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    cols = {}
+    for (name, col) in header["columns"].iteritems():
+        dtype = np.dtype(str(col["dtype"]))
+        if col["length"] == 0:
+            cols[name] = np.zeros(0, dtype=dtype)
+        else:
+            cols[name] = np.frombuffer(mm, dtype=dtype, count=col["length"], offset=start + col["offset"])
+    vh = CompactVersionHistories()
+    for pool in POOLS:
+        setattr(vh, pool, MappedStringPool(cols.pop(pool + "_blob"), cols.pop(pool + "_offsets")))
+    vh.cols = cols
+    vh.end_of_time = from_micros(header["eot"])
+    vh.auxdata = header["aux"]
+    vh.attach_views()
+    return vh
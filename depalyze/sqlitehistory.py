@@ -0,0 +1,269 @@
+import collections
+import json
+import sqlite3
+import pytz
+from versionhistory import VersionHistories
+from compacthistory import to_micros, from_micros
+from lrucache import LRUCache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, author TEXT);
+CREATE TABLE IF NOT EXISTS versions (package INTEGER NOT NULL, version TEXT NOT NULL, time INTEGER NOT NULL,
+                                     PRIMARY KEY (package, version));
+CREATE INDEX IF NOT EXISTS versions_by_time ON versions (package, time);
+CREATE TABLE IF NOT EXISTS deps (package INTEGER NOT NULL, version TEXT NOT NULL, dep TEXT NOT NULL,
+                                 seq INTEGER NOT NULL, tag TEXT, ref TEXT);
+CREATE INDEX IF NOT EXISTS deps_by_version ON deps (package, version);
+CREATE INDEX IF NOT EXISTS deps_by_dep ON deps (dep);
+CREATE TABLE IF NOT EXISTS aux (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+"""
+
+def dep_rows(pid, dv):
+    """deps rows of package pid, one per (version, import, reference); an import with
+    no references gets a single row with seq -1 and no tag or ref, so it isn't lost"""
+    for v in dv:
+        for d in dv[v]:
+            for (i, (tag, ref)) in list(enumerate(dv[v][d])) or [(-1, (None, None))]:
+                yield (pid, v, d, i, tag, ref)
+
+class SqliteAuthors(collections.Mapping):
+    """da: package -> author"""
+    def __init__(self, store): self.store = store
+    def __getitem__(self, p):
+        row = self.store.db.execute("SELECT author FROM packages WHERE name = ?", (p,)).fetchone()
+        if row is None:
+            raise KeyError(p)
+        return row[0]
+    def __iter__(self): return self.store.packages()
+    def __len__(self): return self.store.db.execute("SELECT COUNT(*) FROM packages").fetchone()[0]
+
+class SqliteDates(SqliteAuthors):
+    """dc: package -> version -> date; each package's versions are read in one query"""
+    def __getitem__(self, p):
+        return self.store.cache.get(("dc", p), lambda: self.store.package_dates(p))
+
+class SqliteDeps(SqliteAuthors):
+    """dv: package -> version -> import name -> [(type, versionrefstring)]"""
+    def __getitem__(self, p):
+        return self.store.cache.get(("dv", p), lambda: self.store.package_deps(p))
+
+class SqliteAux(collections.MutableMapping):
+    """auxdata, stored as JSON"""
+    def __init__(self, store): self.store = store
+    def __getitem__(self, key):
+        row = self.store.db.execute("SELECT value FROM aux WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+    def __setitem__(self, key, value):
+        with self.store.db:
+            self.store.db.execute("INSERT OR REPLACE INTO aux VALUES (?, ?)", (key, json.dumps(value)))
+    def __delitem__(self, key):
+        with self.store.db:
+            self.store.db.execute("DELETE FROM aux WHERE key = ?", (key,))
+    def __iter__(self):
+        return (k for (k,) in self.store.db.execute("SELECT key FROM aux").fetchall())
+    def __len__(self): return self.store.db.execute("SELECT COUNT(*) FROM aux").fetchone()[0]
+
+class SqliteReverseDeps(collections.Mapping):
+    """rdepscache: package -> set of packages that have ever depended on it"""
+    def __init__(self, store): self.store = store
+    def __getitem__(self, d): return self.store.reverse_dependencies(d)
+    def __iter__(self):
+        return (d for (d,) in self.store.db.execute("SELECT DISTINCT dep FROM deps").fetchall())
+    def __len__(self):
+        return self.store.cache.get("reverse_dependency_count",
+                                    lambda: self.store.db.execute("SELECT COUNT(DISTINCT dep) FROM deps").fetchone()[0])
+
+class SqliteReverseTimes(SqliteReverseDeps):
+    """rdeptimes: package -> downstream package -> [(versionrefstring, start, end)], computed on demand"""
+    def __getitem__(self, d):
+        return { r: self.store.dep_version_spans(r, d) for r in self.store.reverse_dependencies(d) }
+
+class SqliteVersionHistories(VersionHistories):
+    """VersionHistories kept in an SQLite file, for looking at a few packages without loading everything
+
+    Packages, versions, dependency edges, and aux data are indexed tables, so
+    versions, dependencies, reverse_dependencies, and versionAsOf are single
+    indexed queries, with the most recently used answers kept in an LRUCache.
+    self.da, self.dc, self.dv, self.auxdata, self.rdepscache and self.rdeptimes
+    are views over the tables, so the rest of VersionHistories works as usual.
+
+    preload, preload_packages, update_package and remove_package write through to
+    the file, in one transaction each, so scanners can write directly into it;
+    preload_packages inserts rows in batches as its packages arrive, so scanning
+    into the file needs memory for a batch rather than for the whole ecosystem.
+    """
+
+    def __init__(self, fname, cache_size=10000):
+        VersionHistories.__init__(self)
+        self.fname = fname
+        self.db = sqlite3.connect(fname)
+        self.db.executescript(SCHEMA)
+        self.cache = LRUCache(cache_size)
+        self.da = SqliteAuthors(self)
+        self.dc = SqliteDates(self)
+        self.dv = SqliteDeps(self)
+        self.auxdata = SqliteAux(self)
+        self.rdepscache = SqliteReverseDeps(self)
+        self.rdeptimes = SqliteReverseTimes(self)
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'eot'").fetchone()
+        if row is not None:
+            self.end_of_time = from_micros(row[0])
+
+    def close(self):
+        self.db.close()
+
+    def after_fork(self):
+        """A forked worker must not use its parent's connection; open its own"""
+        self.db = sqlite3.connect(self.fname)
+
+    def preload(self, da, dc, dv, end_of_time):
+        """Replace the contents of the file with ordinary da, dc, dv dicts, in one transaction"""
+        self.preload_packages(((p, da.get(p, ""), dc[p], dv.get(p, {})) for p in dc), end_of_time)
+
+    def preload_packages(self, packages, end_of_time, batch_size=1000):
+        """Replace the contents of the file with an iterable of (package, author, dc, dv), in one
+        transaction, inserting the rows of batch_size packages at a time (see VersionHistories.preload_packages)"""
+        with self.db:
+            for table in ["packages", "versions", "deps"]:
+                self.db.execute("DELETE FROM " + table)
+            ids = {}
+            batch = []
+            batched = set()
+            for (p, author, dc, dv) in packages:
+                if p in batched or len(batch) >= batch_size:
+                    self.insert_batch(batch, ids)
+                    batch = []
+                    batched = set()
+                if p in ids:
+                    # already inserted: replace the versions this repeats
+                    self.db.executemany("DELETE FROM deps WHERE package = ? AND version = ?",
+                                        ((ids[p], v) for v in set(dc) | set(dv)))
+                else:
+                    ids[p] = len(ids) + 1
+                batch.append((p, author, dc, dv))
+                batched.add(p)
+            self.insert_batch(batch, ids)
+        self.cache.clear()
+        self.fingerprints = {}
+        self.graphcache = {}
+        self.set_end_of_time(end_of_time)
+
+    def insert_batch(self, batch, ids):
+        """Insert the rows of several (package, author, dc, dv), whose packages have ids in ids"""
+        self.db.executemany("INSERT OR REPLACE INTO packages VALUES (?, ?, ?)",
+                            ((ids[p], p, author) for (p, author, dc, dv) in batch))
+        self.db.executemany("INSERT OR REPLACE INTO versions VALUES (?, ?, ?)",
+                            ((ids[p], v, to_micros(dc[v])) for (p, author, dc, dv) in batch for v in dc))
+        self.db.executemany("INSERT INTO deps VALUES (?, ?, ?, ?, ?, ?)",
+                            (row for (p, author, dc, dv) in batch for row in dep_rows(ids[p], dv)))
+
+    def insert_package(self, p, author, dc, dv):
+        cur = self.db.execute("INSERT INTO packages (name, author) VALUES (?, ?)", (p, author))
+        pid = cur.lastrowid
+        self.db.executemany("INSERT INTO versions VALUES (?, ?, ?)",
+                            ((pid, v, to_micros(dc[v])) for v in dc))
+        self.db.executemany("INSERT INTO deps VALUES (?, ?, ?, ?, ?, ?)", dep_rows(pid, dv))
+
+    def delete_package(self, p):
+        row = self.db.execute("SELECT id FROM packages WHERE name = ?", (p,)).fetchone()
+        if row is not None:
+            for table in ["versions", "deps"]:
+                self.db.execute("DELETE FROM " + table + " WHERE package = ?", row)
+            self.db.execute("DELETE FROM packages WHERE id = ?", row)
+
+    def update_package(self, package, author, dc, dv):
+        with self.db:
+            self.delete_package(package)
+            self.insert_package(package, author, dc, dv)
+        self.cache.clear()
+        self.fingerprints = {}
+        self.graphcache = {}
+
+    def remove_package(self, package):
+        with self.db:
+            self.delete_package(package)
+        self.cache.clear()
+        self.fingerprints = {}
+        self.graphcache = {}
+
+    def set_end_of_time(self, end_of_time):
+        self.end_of_time = end_of_time
+        if self.end_of_time.tzinfo is None:
+            self.end_of_time = self.end_of_time.replace(tzinfo=pytz.UTC)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('eot', ?)", (to_micros(self.end_of_time),))
+        self.cache.clear()
+
+    def force_timezone_awareness(self):
+        pass   # times are always stored as UTC
+
+    def buildReverseDependencies(self, processes=None, shard_size=1000):
+        pass   # reverse dependencies are an indexed query
+
+    def package_id(self, p):
+        row = self.db.execute("SELECT id FROM packages WHERE name = ?", (p,)).fetchone()
+        if row is None:
+            raise KeyError(p)
+        return row[0]
+
+    def package_dates(self, p):
+        pid = self.package_id(p)
+        return { v: from_micros(t) for (v, t) in
+                    self.db.execute("SELECT version, time FROM versions WHERE package = ?", (pid,)) }
+
+    def package_deps(self, p):
+        pid = self.package_id(p)
+        deps = { v: {} for v in self.dc[p] }
+        for (v, d, seq, tag, ref) in self.db.execute(
+                "SELECT version, dep, seq, tag, ref FROM deps WHERE package = ? ORDER BY seq", (pid,)):
+            refs = deps[v].setdefault(d, [])
+            if seq >= 0:
+                refs.append((tag, ref))
+        return deps
+
+    def packages(self):
+        for (p,) in self.db.execute("SELECT name FROM packages").fetchall():
+            yield p
+
+    def version_index(self, package):
+        """([versions], [dates]) of this package, in chrono order"""
+        def query():
+            pid = self.package_id(package)
+            rows = self.db.execute("SELECT version, time FROM versions WHERE package = ? ORDER BY time",
+                                   (pid,)).fetchall()
+            return ([v for (v, t) in rows], [from_micros(t) for (v, t) in rows])
+        return self.cache.get(("version_index", package), query)
+
+    def dependencies(self, package):
+        """List all packages that have ever been dependencies of a package"""
+        def query():
+            pid = self.package_id(package)
+            return set(d for (d,) in self.db.execute(
+                "SELECT DISTINCT dep FROM deps WHERE package = ?", (pid,)))
+        return self.cache.get(("dependencies", package), query)
+
+    def present_dependencies(self, package):
+        def query():
+            pid = self.package_id(package)
+            return [d for (d,) in self.db.execute(
+                """SELECT DISTINCT deps.dep FROM deps JOIN packages ON packages.name = deps.dep
+                   WHERE deps.package = ? AND deps.version = ?""",
+                (pid, self.latest_version(package)))]
+        return self.cache.get(("present_dependencies", package), query)
+
+    def reverse_dependencies(self, package):
+        def query():
+            return set(p for (p,) in self.db.execute(
+                """SELECT DISTINCT packages.name FROM deps JOIN packages ON packages.id = deps.package
+                   WHERE deps.dep = ?""", (package,)))
+        return self.cache.get(("reverse_dependencies", package), query)
+
+    def versionAsOf(self, p, asOfDate):
+        "What version of package p was newest as of some date?"
+        row = self.db.execute(
+            "SELECT version FROM versions WHERE package = ? AND time < ? ORDER BY time DESC LIMIT 1",
+            (self.package_id(p), to_micros(asOfDate))).fetchone()
+        return row[0] if row is not None else None
@@ -0,0 +1,109 @@
+"""Ecosystem statistics as vectorized expressions over per-package NumPy columns
+
+PackageStats extracts each column (version count, first and last release,
+dependency count, ...) from a VersionHistories in one pass over its packages,
+the first time it is asked for.  A statistic is then an array of values
+parallel to PackageStats.names together with a boolean mask of the packages
+it applies to; describe() summarizes one.
+"""
+import numpy as np
+
+def describe(values, mask=None, quantiles=(0.0, 0.25, 0.5, 0.75, 1.0)):
+    """{ "count", "mean", "quantiles": { q: value }, "distribution": sorted values } of the masked values"""
+    values = np.asarray(values, dtype=float)
+    if mask is not None:
+        values = values[mask]
+    values = np.sort(values)
+    if len(values) == 0:
+        return { "count": 0, "mean": float("nan"), "quantiles": { q: float("nan") for q in quantiles },
+                 "distribution": values }
+    return { "count": len(values),
+             "mean": values.mean(),
+             "quantiles": dict(zip(quantiles, np.percentile(values, [100.0 * q for q in quantiles]))),
+             "distribution": values }
+
+class PackageStats:
+    """Per-package columns of a VersionHistories, as arrays parallel to self.names
+
+    Columns: version_count, first_release and last_release (microseconds since
+    the epoch; 0 for packages without versions), span_days (whole days between
+    them), dependency_count (of the latest version, ignoring packages R loads
+    by default), dependency_changes (number of versions that changed the
+    dependencies; see VersionHistories.dep_changes) and
+    reverse_dependency_count (packages that ever depended on it).
+    """
+
+    def __init__(self, vh):
+        from compacthistory import to_micros
+        self.vh = vh
+        self.to_micros = to_micros
+        self.names = list(vh.packages())
+        self.columns = {}
+
+    def column(self, name):
+        if name not in self.columns:
+            self.columns[name] = getattr(self, "compute_" + name)()
+        return self.columns[name]
+
+    def compute_version_count(self):
+        return np.array([len(self.vh.version_index(p)[0]) for p in self.names], dtype=np.int64)
+
+    def compute_first_release(self):
+        return np.array([self.release(p, 0) for p in self.names], dtype=np.int64)
+
+    def compute_last_release(self):
+        return np.array([self.release(p, -1) for p in self.names], dtype=np.int64)
+
+    def release(self, p, i):
+        dates = self.vh.version_index(p)[1]
+        return self.to_micros(dates[i]) if len(dates) > 0 else 0
+
+    def compute_span_days(self):
+        spans = []
+        for p in self.names:
+            dates = self.vh.version_index(p)[1]
+            spans.append((dates[-1] - dates[0]).days if len(dates) > 0 else 0)
+        return np.array(spans, dtype=np.int64)
+
+    def compute_dependency_count(self):
+        from versionhistory import defaultLoaded
+        exclude = set(defaultLoaded)
+        counts = []
+        for p in self.names:
+            vers = self.vh.versions(p)
+            counts.append(len(set(self.vh.dv[p][vers[-1]]) - exclude) if len(vers) > 0 else 0)
+        return np.array(counts, dtype=np.int64)
+
+    def compute_dependency_changes(self):
+        return np.array([len(self.vh.dep_changes(p)) for p in self.names], dtype=np.int64)
+
+    def compute_reverse_dependency_count(self):
+        counts = []
+        for p in self.names:
+            try:
+                counts.append(len(self.vh.reverse_dependencies(p)))
+            except KeyError:
+                counts.append(0)
+        return np.array(counts, dtype=np.int64)
+
+    def mask(self, criterion):
+        """Boolean mask of the packages p for which criterion(p) is true"""
+        return np.array([bool(criterion(p)) for p in self.names], dtype=bool)
+
+    def update_frequency(self):
+        """(updates per day, applicable): packages with only one version are not applicable"""
+        n = self.column("version_count")
+        span = self.column("span_days")
+        applicable = n >= 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frequency = np.where(span == 0, 0.0, (n - 1.0) / span)
+        return (np.where(applicable, frequency, np.nan), applicable)
+
+    def dependency_update_frequency(self):
+        """(dependency changes per day, applicable): only packages that other packages have
+        depended on, and whose versions span at least a day, are applicable"""
+        span = self.column("span_days")
+        applicable = (self.column("reverse_dependency_count") > 0) & (span > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frequency = (self.column("dependency_changes") - 1.0) / span
+        return (np.where(applicable, frequency, np.nan), applicable)
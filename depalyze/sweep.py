@@ -0,0 +1,184 @@
+"""Compute ecosystem-wide time series in one chronological pass over every package
+
+package_events yields one package's releases and dependency changes in
+order; events merges those streams across packages with a heap-based k-way
+merge; sweep feeds the merged stream to a set of reducers, telling each one
+whenever the stream passes one of the requested dates.
+
+Each reducer's result() is a list parallel to the requested dates.  Reducers
+of a state (e.g. PackageCount) report it as of each date, counting only
+releases strictly before it, as VersionHistories.versionAsOf does; reducers of
+a flow (e.g. ReleaseCount) report the events from the previous date up to each
+date (for the first date, every event before it).
+"""
+import heapq
+from collections import namedtuple
+from dateutil.relativedelta import relativedelta
+
+RELEASE = "release"
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+# old and new are the first version reference strings of dep before and after
+# the change (None when the dependency is absent, or has no reference string)
+Event = namedtuple("Event", ["date", "package", "kind", "version", "dep", "old", "new"])
+
+def periods(start, end, resolution=relativedelta(months=1)):
+    """Dates from start to end (inclusive), every resolution"""
+    dates = []
+    k = 0
+    while start + resolution * k <= end:
+        dates.append(start + resolution * k)
+        k += 1
+    return dates
+
+def reference(refs):
+    return refs[0][1] if len(refs) > 0 else None
+
+def package_events(vh, p):
+    """Yield the Events of one package in chronological order
+
+    Each release is followed by the changes it made to the package's
+    dependencies.  Releases dated on or before VersionHistories.earliest_date
+    are placeholders and are skipped."""
+    from versionhistory import VersionHistories
+    previous = {}
+    (vers, dates) = vh.version_index(p)
+    for (v, date) in zip(vers, dates):
+        if date <= VersionHistories.earliest_date:
+            continue
+        yield Event(date, p, RELEASE, v, None, None, None)
+        current = { d: reference(refs) for (d, refs) in vh.dv[p][v].iteritems() }
+        for d in sorted(previous):
+            if d not in current:
+                yield Event(date, p, REMOVED, v, d, previous[d], None)
+        for d in sorted(current):
+            if d not in previous:
+                yield Event(date, p, ADDED, v, d, None, current[d])
+            elif current[d] != previous[d]:
+                yield Event(date, p, CHANGED, v, d, previous[d], current[d])
+        previous = current
+
+def events(vh, packages=None):
+    """Yield the Events of every package (or just of packages), merged chronologically"""
+    if packages is None:
+        packages = vh.packages()
+    return heapq.merge(*[package_events(vh, p) for p in packages])
+
+def sweep(vh, reducers, asOfDates, packages=None):
+    """Feed every event to each reducer in one pass, closing each at each of asOfDates
+
+    returns: [reducer.result() for each reducer]"""
+    asOfDates = sorted(asOfDates)
+    k = 0
+    for e in events(vh, packages):
+        while k < len(asOfDates) and e.date >= asOfDates[k]:
+            for r in reducers:
+                r.close(asOfDates[k])
+            k += 1
+        if k == len(asOfDates):
+            break
+        for r in reducers:
+            r.event(e)
+    for d in asOfDates[k:]:
+        for r in reducers:
+            r.close(d)
+    return [r.result() for r in reducers]
+
+class Reducer:
+    """Summarizes an event stream as a time series; subclasses override event and close"""
+    def __init__(self):
+        self.series = []
+
+    def event(self, e):
+        pass
+
+    def close(self, date):
+        pass
+
+    def result(self):
+        return self.series
+
+class ReleaseCount(Reducer):
+    """Number of releases since the previous date"""
+    def __init__(self):
+        Reducer.__init__(self)
+        self.count = 0
+
+    def event(self, e):
+        if e.kind == RELEASE:
+            self.count += 1
+
+    def close(self, date):
+        self.series.append(self.count)
+        self.count = 0
+
+class ActivePackages(Reducer):
+    """Number of packages with at least activity_level releases since the previous date"""
+    def __init__(self, activity_level=1):
+        Reducer.__init__(self)
+        self.activity_level = activity_level
+        self.releases = {}
+
+    def event(self, e):
+        if e.kind == RELEASE:
+            self.releases[e.package] = self.releases.get(e.package, 0) + 1
+
+    def close(self, date):
+        self.series.append(len([p for p in self.releases if self.releases[p] >= self.activity_level]))
+        self.releases = {}
+
+class ConstraintChanges(Reducer):
+    """Number of dependencies added, removed, or pointed at a new version since the previous date"""
+    def __init__(self):
+        Reducer.__init__(self)
+        self.count = 0
+
+    def event(self, e):
+        if e.kind != RELEASE:
+            self.count += 1
+
+    def close(self, date):
+        self.series.append(self.count)
+        self.count = 0
+
+class PackageCount(Reducer):
+    """Number of packages released so far"""
+    def __init__(self):
+        Reducer.__init__(self)
+        self.seen = set()
+
+    def event(self, e):
+        if e.kind == RELEASE:
+            self.seen.add(e.package)
+
+    def close(self, date):
+        self.series.append(len(self.seen))
+
+class DependencyCounts(Reducer):
+    """Dependency count of each package released so far, ignoring dependencies in exclude
+
+    Each entry of the series is a list of counts, in the order of packages
+    (if given) or of first release."""
+    def __init__(self, exclude=(), packages=None):
+        Reducer.__init__(self)
+        self.exclude = set(exclude)
+        self.order = list(packages) if packages is not None else []
+        self.track_order = packages is None
+        self.counts = {}
+
+    def event(self, e):
+        if e.kind == RELEASE:
+            if e.package not in self.counts:
+                self.counts[e.package] = 0
+                if self.track_order:
+                    self.order.append(e.package)
+        elif e.dep not in self.exclude:
+            if e.kind == ADDED:
+                self.counts[e.package] += 1
+            elif e.kind == REMOVED:
+                self.counts[e.package] -= 1
+
+    def close(self, date):
+        self.series.append([self.counts[p] for p in self.order if p in self.counts])
@@ -0,0 +1,151 @@
+"""Stream the textual timelines of VersionHistories.showTimeline, for one package or a whole ecosystem
+
+A timeline interleaves the releases of a focal package, of its dependencies
+and of its reverse dependencies, and the changes in the version references
+between them.  Each of those is already in time order, so rows merges them
+with a heap-based k-way merge and formats each row as it is needed, instead
+of collecting and sorting the whole history first.
+
+export_timelines writes the timeline of every package into a directory, or
+into one .zip or .tar(.gz, .bz2) archive, one package at a time, so memory
+use doesn't grow with the number of packages.
+"""
+import heapq
+import os
+import tarfile
+import tempfile
+import zipfile
+from render import write_atomically
+
+ARCHIVES = [(".zip", None), (".tar", "w"), (".tar.gz", "w:gz"), (".tgz", "w:gz"), (".tar.bz2", "w:bz2")]
+
+COLUMNS = { "focal": 0, "dep": 1, "revdep": 2 }
+(RELEASE, REFERENCE) = (0, 1)
+
+def releases(vh, p, colname):
+    """Yield (date, column, p, RELEASE, i, colname, text) for the i'th release of p, in time order"""
+    try:
+        (vers, dates) = vh.version_index(p)
+    except KeyError:
+        return
+    for (i, (v, date)) in enumerate(zip(vers, dates)):
+        yield (date, COLUMNS[colname], p, RELEASE, i, colname, p + " v" + v)
+
+def references(spans, src, dst, colname, p):
+    """Yield (date, column, p, REFERENCE, i, colname, text) for the start of the i'th span of src's
+    references to dst, in time order"""
+    for (i, (k, st, en)) in enumerate(spans):
+        yield (st, COLUMNS[colname], p, REFERENCE, i, colname, "ref: " + src + " -> " + dst + " v" + k)
+
+def history(vh, package):
+    """Yield (date, colname, text) of each event in package's timeline, in time order
+
+    Events on the same date are ordered by column (the focal package, then its
+    dependencies, then its reverse dependencies), then by the name of the
+    dependency or reverse dependency, releases before references, so the
+    order doesn't depend on how a backend happens to order its dicts."""
+    streams = [releases(vh, package, "focal")]
+    for d in vh.dependencies(package):
+        streams.append(releases(vh, d, "dep"))
+        try:
+            streams.append(references(vh.rdeptimes[d][package], package, d, "dep", d))
+        except KeyError:
+            pass
+    downstreams = vh.rdeptimes[package]
+    for r in downstreams.keys():
+        streams.append(releases(vh, r, "revdep"))
+        streams.append(references(downstreams[r], r, package, "revdep", r))
+    for event in heapq.merge(*streams):
+        yield (event[0], event[5], event[6])
+
+def rows(vh, package, colwidth=20):
+    """Yield the header and then each row of package's timeline, formatted as showTimeline does"""
+    format = "%25s   %{}s   %{}s   %{}s".format(colwidth, colwidth, colwidth)
+    yield format % ("Time", "Dependency changes", package, "Downstream dependencies")
+    lasttime = ""
+    for (tstamp, colname, text) in history(vh, package):
+        try:
+            tempus = tstamp.strftime("%Y-%m-%d")
+        except Exception, e:
+            vh.logwith("Invalid date", str(tstamp), e)
+            tempus = "(bad date)"
+        if tempus == lasttime:
+            tempus = ""
+        else:
+            lasttime = tempus
+        (tleft, tmid, tright) = (text if colname == "dep" else "",
+                                 text if colname == "focal" else "",
+                                 text if colname == "revdep" else "")
+        yield format % (tempus, tleft, tmid, tright)
+
+def write_rows(f, lines):
+    """Write lines to file f, one per line but without a final newline, as ascii"""
+    first = True
+    for line in lines:
+        if not first:
+            f.write("\n")
+        f.write(line.encode("ascii", "ignore"))
+        first = False
+
+def timeline_name(p):
+    return p.replace("/", "_") + ".timeline.txt"
+
+def archive_mode(target):
+    """(True, tarfile mode or None for zip) if target names an archive, else (False, None)"""
+    for (ext, mode) in ARCHIVES:
+        if target.endswith(ext):
+            return (True, mode)
+    return (False, None)
+
+def export_timelines(vh, target, packages=None, colwidth=20):
+    """Write the timeline of each package (default: every package) into target
+
+    target: a directory, which gets a p.timeline.txt for each package p ("/" in
+        p replaced by "_"), or the name of a .zip, .tar, .tar.gz, .tgz or
+        .tar.bz2 archive to hold those files.  Each file (or the archive as a
+        whole) is written under a temporary name and renamed into place.
+    returns: { "written": number of timelines written, "failed": { package: error } }
+    """
+    if len(vh.rdepscache) == 0:
+        vh.buildReverseDependencies()
+    if packages is None:
+        packages = vh.packages()
+    summary = { "written": 0, "failed": {} }
+    (archived, mode) = archive_mode(target)
+    if not archived:
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        for p in packages:
+            def write(fname):
+                with open(fname, "w") as f:
+                    write_rows(f, rows(vh, p, colwidth))
+            export_one(vh, summary, p, lambda: write_atomically(os.path.join(target, timeline_name(p)), write))
+        return summary
+
+    def write_archive(fname):
+        archive = zipfile.ZipFile(fname, "w", zipfile.ZIP_DEFLATED, True) if mode is None else tarfile.open(fname, mode)
+        (fd, scratch) = tempfile.mkstemp(suffix=".timeline.txt")
+        os.close(fd)
+        try:
+            for p in packages:
+                def add():
+                    with open(scratch, "w") as f:
+                        write_rows(f, rows(vh, p, colwidth))
+                    if mode is None:
+                        archive.write(scratch, timeline_name(p))
+                    else:
+                        archive.add(scratch, timeline_name(p))
+                export_one(vh, summary, p, add)
+        finally:
+            archive.close()
+            os.remove(scratch)
+    write_atomically(target, write_archive)
+    return summary
+
+def export_one(vh, summary, p, export):
+    try:
+        export()
+        summary["written"] += 1
+    except Exception, e:
+        summary["failed"][p] = type(e).__name__ + ": " + str(e)
+        vh.logwith("Failed to export timeline of", p, ":", e)
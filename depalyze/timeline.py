@@ -2,37 +2,50 @@ from matplotlib import scale as mscale
 from matplotlib import dates
 from matplotlib import textpath
 from matplotlib import pyplot
+from matplotlib.collections import LineCollection
+from collections import defaultdict
+from lrucache import LRUCache
+
+caption_widths = LRUCache(10000)
+
+def caption_width(caption, size):
+    """Width of caption's TextPath at this font size; remembered, since the same captions recur"""
+    return caption_widths.get((caption, size),
+                              lambda: textpath.TextPath((0,0), caption, size=size).get_extents().width)
 
 class Timeline:
     #dateformatter = dates.DateFormatter('%m %y')
 
     def __init__(self):
         self.spans = []
+        self.index = defaultdict(list)
+        self.cats = []
+        self.catset = set()
         self.connections = []
         self.loc = dates.AutoDateLocator()
         self.fmt = dates.AutoDateFormatter(self.loc)
         pass
 
     def findByKey(self,key): 
-        return [rec for rec in self.spans if rec["key"] == key]
+        return list(self.index.get(key, []))
 
     def span(self, category, start, end, key, caption, color, half, invisibleBar = False):
-        self.spans.append(
-            {"cat": category, 
-             "start": start,
-             "key": key,
-             "color": color,
-             "end": end,
-             "half": half,
-             "caption": caption,
-             "invisibleBar": invisibleBar})
+        sp = {"cat": category, 
+              "start": start,
+              "key": key,
+              "color": color,
+              "end": end,
+              "half": half,
+              "caption": caption,
+              "invisibleBar": invisibleBar}
+        self.spans.append(sp)
+        self.index[key].append(sp)
+        if category not in self.catset:
+            self.catset.add(category)
+            self.cats.append(category)
 
     def categories(self):
-        cats = []
-        for sp in self.spans:
-            if sp["cat"] not in cats:
-                cats.append(sp["cat"])
-        return cats
+        return list(self.cats)
 
     def timerange(self, filter=lambda sp: True):
         start = min({ sp["start"] for sp in self.spans if filter (sp) })
@@ -73,49 +86,47 @@ class Timeline:
         #    label.set_fontproperties({"size":40})
 
     def draw_bars(self, ax):
+        """Draw the bars of each (category, half) as one collection, then their captions"""
         xf = self.xmapping()
         yf = self.ymapping()
         factor = self.stretch / 4000.0
         print("Factor ",factor,"=" ,self.stretch, "/2000")
+        rows = defaultdict(list)
+        for sp in self.spans:
+            rows[(sp["cat"], sp["half"])].append(sp)
+        for ((cat, half), sps) in rows.items():
+            (bottom, top) = yf(cat, half)
+            ax.broken_barh([(xf(sp["start"]), xf(sp["end"]) - xf(sp["start"])) for sp in sps],
+                           (bottom, top - bottom),
+                           facecolors=["white" if sp["invisibleBar"] else sp["color"] for sp in sps],
+                           edgecolors=["white" if sp["invisibleBar"] else "none" for sp in sps])
+
+        xmin = ax.get_xlim()[0]
         for sp in self.spans:
-            if sp["invisibleBar"]:
-                ax.bar(xf(sp["start"]),
-                       yf(sp["cat"],sp["half"])[1]-yf(sp["cat"],sp["half"])[0],
-                       xf(sp["end"]) - xf(sp["start"]),
-                       color="white", edgecolor="white",
-                       bottom=yf(sp["cat"],sp["half"])[0])
-            else:
-                ax.bar(xf(sp["start"]),
-                       yf(sp["cat"],sp["half"])[1]-yf(sp["cat"],sp["half"])[0],
-                       xf(sp["end"]) - xf(sp["start"]),
-                       color=sp["color"],
-                       bottom=yf(sp["cat"],sp["half"])[0])
-            
-            if xf(sp["start"]) >= pyplot.xlim()[0] and xf(sp["end"])-xf(sp["start"]) > .5 and sp["caption"] != "":
-                t = textpath.TextPath((0,0), " " + sp["caption"], size=40)
+            if xf(sp["start"]) >= xmin and xf(sp["end"])-xf(sp["start"]) > .5 and sp["caption"] != "":
                 if sp["invisibleBar"]:
-                    pyplot.text(sp["start"]+.1, yf(sp["cat"],sp["half"])[1],
+                    ax.text(sp["start"]+.1, yf(sp["cat"],sp["half"])[1],
                             sp["caption"], ha='left', va='top',
                             rotation=-25, size=20)
-                elif t.get_extents().width * factor < xf(sp["end"])-xf(sp["start"]):
-                    pyplot.text(xf(sp["start"])+1, yf(sp["cat"],sp["half"])[0]+.05,
+                elif caption_width(" " + sp["caption"], 40) * factor < xf(sp["end"])-xf(sp["start"]):
+                    ax.text(xf(sp["start"])+1, yf(sp["cat"],sp["half"])[0]+.05,
                             sp["caption"], ha='left', va='bottom', size=40)
                 else:
-                    pyplot.text(sp["start"]+.1, yf(sp["cat"],sp["half"])[0]+.05,
+                    ax.text(sp["start"]+.1, yf(sp["cat"],sp["half"])[0]+.05,
                             sp["caption"], ha='left', va='bottom',
                             rotation='vertical', size=16)
-            
 
     def draw_connections(self, ax):
+        """Draw every connection as one LineCollection"""
         xf = self.xmapping()
         yf = self.ymapping()
-        for (f,t) in self.connections:
-            ax.plot([xf(f["start"]),
-                     xf(t["start"])],
-                    [yf(f["cat"], f["half"])[0], yf(t["cat"], t["half"])[1]],
-                    color="r")
+        segments = [[(xf(f["start"]), yf(f["cat"], f["half"])[0]),
+                     (xf(t["start"]), yf(t["cat"], t["half"])[1])]
+                    for (f,t) in self.connections]
+        if len(segments) > 0:
+            ax.add_collection(LineCollection(segments, colors="r"))
+            ax.autoscale_view()
 
-                   
     def connect(self, keyfrom, keyto):
         self.connections.append((keyfrom,keyto))
 
@@ -0,0 +1,150 @@
+import bisect
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+class GraphSnapshot:
+    """The dependency graph as of one date, in compressed sparse row form
+
+    rows[pid] is the version row current at that date of package names[pid]
+    (-1 if it had not been released yet); that package's dependencies are the
+    package ids indices[indptr[pid]:indptr[pid+1]], in ascending order.
+    Only dependencies on known packages are included.
+    """
+
+    def __init__(self, timeline, date, rows):
+        self.timeline = timeline
+        self.date = date
+        self.names = timeline.names
+        self.ids = timeline.ids
+        self.rows = rows
+        released = rows >= 0
+        firsts = np.zeros(len(rows), dtype=np.int64)
+        lengths = np.zeros(len(rows), dtype=np.int64)
+        firsts[released] = timeline.edge_indptr[rows[released]]
+        lengths[released] = timeline.edge_indptr[rows[released] + 1] - firsts[released]
+        self.indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        starts = np.repeat(firsts - self.indptr[:-1], lengths)
+        self.indices = timeline.edge_indices[np.arange(self.indptr[-1]) + starts]
+
+    def packages(self):
+        """Names of the packages released by this date"""
+        return [self.names[pid] for pid in np.flatnonzero(self.rows >= 0)]
+
+    def version(self, package):
+        """Version of package current at this date, or None"""
+        row = self.rows[self.ids[package]]
+        return self.timeline.row_versions[row] if row >= 0 else None
+
+    def dependency_ids(self, pid):
+        return self.indices[self.indptr[pid]:self.indptr[pid+1]]
+
+    def dependencies(self, package):
+        """Names of the packages that package's current version depends on"""
+        return [self.names[d] for d in self.dependency_ids(self.ids[package])]
+
+    def edge_count(self):
+        return len(self.indices)
+
+    def out_degrees(self):
+        """Number of dependencies of each package, as an array indexed by package id"""
+        return np.diff(self.indptr)
+
+    def in_degrees(self):
+        """Number of packages depending on each package, as an array indexed by package id"""
+        return np.bincount(self.indices, minlength=len(self.names))
+
+    def as_dict(self):
+        """{ package: (version, [dependencies]) } for each package released by this date"""
+        return { self.names[pid]: (self.timeline.row_versions[self.rows[pid]],
+                                   [self.names[d] for d in self.dependency_ids(pid)])
+                 for pid in np.flatnonzero(self.rows >= 0) }
+
+class GraphTimeline:
+    """Reconstruct the whole dependency graph as of any date
+
+    Every release is an event that changes one package's current version.
+    Each package version's dependencies are stored once, as rows of one CSR
+    array, so the graph as of a date is fully described by which row is
+    current for each package.  That vector is saved at checkpoints every
+    interval from the first release; asOf starts from the last checkpoint
+    before the requested date and applies only the releases since then.
+
+    As with VersionHistories.versionAsOf, a version is current as of dates
+    strictly after its release, and releases dated on or before
+    VersionHistories.earliest_date are ignored.
+    """
+
+    def __init__(self, vh, interval=relativedelta(years=1)):
+        from versionhistory import VersionHistories
+        from compacthistory import to_micros, from_micros
+        self.to_micros = to_micros
+        self.interval = interval
+        self.names = sorted(vh.packages())
+        self.ids = { p: i for (i, p) in enumerate(self.names) }
+        earliest = to_micros(VersionHistories.earliest_date)
+        self.row_versions = []
+        edge_counts = []
+        edges = []
+        events = []
+        for (pid, p) in enumerate(self.names):
+            (vers, dates) = vh.version_index(p)
+            deps = vh.dv[p]
+            for (v, date) in zip(vers, dates):
+                row = len(self.row_versions)
+                self.row_versions.append(v)
+                ds = sorted(set(self.ids[d] for d in deps.get(v, {}) if d in self.ids))
+                edge_counts.append(len(ds))
+                edges.extend(ds)
+                t = to_micros(date)
+                if t > earliest:
+                    events.append((t, pid, row))
+        self.edge_indptr = np.concatenate([[0], np.cumsum(edge_counts, dtype=np.int64)]).astype(np.int64)
+        self.edge_indices = np.array(edges, dtype=np.int32)
+        events.sort()
+        columns = np.array(events, dtype=np.int64).reshape(-1, 3)
+        self.event_times = columns[:, 0].copy()
+        self.event_pkgs = columns[:, 1].astype(np.int32)
+        self.event_rows = columns[:, 2].astype(np.int32)
+        self.checkpoints = []
+        self.checkpoint_times = []
+        if len(events) > 0:
+            (first, last) = (from_micros(events[0][0]), from_micros(events[-1][0]))
+            rows = np.full(len(self.names), -1, dtype=np.int32)
+            applied = 0
+            k = 0
+            while True:
+                date = first + interval * k
+                t = to_micros(date)
+                upto = np.searchsorted(self.event_times, t, side="left")
+                rows = self.apply(rows.copy(), applied, upto)
+                applied = upto
+                self.checkpoints.append((date, applied, rows))
+                self.checkpoint_times.append(t)
+                if date > last:
+                    break
+                k += 1
+
+    def apply(self, rows, start, stop):
+        """Set rows to reflect the releases start:stop, the last release of each package winning"""
+        if stop > start:
+            pkgs = self.event_pkgs[start:stop][::-1]
+            (changed, latest) = np.unique(pkgs, return_index=True)
+            rows[changed] = self.event_rows[start:stop][::-1][latest]
+        return rows
+
+    def rowsAsOf(self, asOfDate):
+        t = self.to_micros(asOfDate)
+        upto = np.searchsorted(self.event_times, t, side="left")
+        c = bisect.bisect_right(self.checkpoint_times, t) - 1
+        if c < 0:
+            return self.apply(np.full(len(self.names), -1, dtype=np.int32), 0, upto)
+        (date, applied, rows) = self.checkpoints[c]
+        return self.apply(rows.copy(), applied, upto)
+
+    def asOf(self, asOfDate):
+        """GraphSnapshot of the dependency graph as of a date"""
+        return GraphSnapshot(self, asOfDate, self.rowsAsOf(asOfDate))
+
+    def asOfDates(self, asOfDates):
+        """GraphSnapshots as of each of several dates"""
+        return [self.asOf(d) for d in asOfDates]
@@ -3,18 +3,24 @@ import pdb
 import pytz
 import sys
 import json
+import hashlib
 import dateutil.parser
 from dateutil.relativedelta import relativedelta
 import re
+import bisect
 from collections import defaultdict
 import datetime
-from timeline import Timeline
 import dateutil
 from pointspans import PointSpans
-from matplotlib import dates
-from matplotlib import pyplot
-import matplotlib
-from pylab import *
+import parallel
+from closure import TransitiveClosure
+from timetravel import GraphTimeline
+import sweep
+import render
+import texttimeline
+from constraints import ConstraintResolver
+from authors import AuthorSimilarity
+from stats import PackageStats
 
 
 class NotApplicable(Exception): 
@@ -54,6 +60,8 @@ class VersionHistories():
 
      self.end_of_time: the last date we have version history data about; e.g. today, if
              dataset is current
+
+     self.vindex = name -> ([versions], [dates]), in chrono order; see version_index
     """
 
     def __init__(self):
@@ -63,6 +71,11 @@ class VersionHistories():
         self.auxdata = {}
         self.depscache = {}
         self.rdepscache = {}
+        self.rdeptimes = {}
+        self.vindex = {}
+        self.fingerprints = {}
+        self.graphcache = {}
+        self.authorsim = AuthorSimilarity()
         self.logwith = lambda *k: print(*k)
         self.end_of_time = datetime.datetime.now().replace(tzinfo=pytz.UTC)
 
@@ -72,13 +85,18 @@ class VersionHistories():
                 "dv": self.dv, 
                 "aux": self.auxdata, 
                 "eot": self.end_of_time, 
-                "deps": self.depscache, 
-                "rdeps": self.rdepscache}
+                "deps": { p: sorted(self.depscache[p]) for p in self.depscache },
+                "rdeps": { d: sorted(self.rdepscache[d]) for d in self.rdepscache },
+                "rdeptimes": { d: dict(self.rdeptimes[d]) for d in self.rdeptimes }}
 
     def deserialize(self, dct):
         self.preload(dct["da"], dct["dc"], dct["dv"], dct["eot"]) 
-        self.depscache = dct["deps"]
-        self.rdepscache = dct["rdeps"]
+        self.depscache = { p: set(dct["deps"][p]) for p in dct["deps"] }
+        if "rdeptimes" in dct:
+            self.rdepscache = { d: set(dct["rdeps"][d]) for d in dct["rdeps"] }
+            self.rdeptimes = { d: { p: [tuple(span) for span in dct["rdeptimes"][d][p]]
+                                        for p in dct["rdeptimes"][d] }
+                                   for d in dct["rdeptimes"] }
         self.auxdata = dct["aux"] if "aux" in dct else {}
         self.logwith("Loaded ", len(list(self.packages())), "packages")
 
@@ -89,9 +107,16 @@ class VersionHistories():
         self.auxdata[key] = data
 
     def set_end_of_time(self, end_of_time):
+        old_end_of_time = self.end_of_time
         self.end_of_time = end_of_time
         if self.end_of_time.tzinfo is None:
             self.end_of_time = self.end_of_time.replace(tzinfo=pytz.UTC)
+        # Spans that ran to the old end of time now run to the new one
+        for d in self.rdeptimes:
+            for p in self.rdeptimes[d]:
+                spans = self.rdeptimes[d][p]
+                if len(spans) > 0 and spans[-1][2] == old_end_of_time:
+                    spans[-1] = (spans[-1][0], spans[-1][1], self.end_of_time)
 
     def force_timezone_awareness(self):
         if self.end_of_time.tzinfo is None:
@@ -122,44 +147,164 @@ class VersionHistories():
         self.dv = dv
         self.depscache = {}
         self.rdepscache = {}
+        self.rdeptimes = {}
         self.end_of_time = end_of_time
         self.force_timezone_awareness()
+        self.graphcache = {}
+        self.fingerprints = {}
+        self.vindex = {}
+        for p in self.dc:
+            self.index_versions(p)
+
+    def preload_packages(self, packages, end_of_time):
+        """Like preload, from an iterable of (package, author, dc, dv), one package's entries at a time
+
+        A package may come up more than once; its versions are merged, later
+        ones replacing earlier ones with the same name.  This collects them into
+        dicts and preloads those; a subclass that keeps its data elsewhere (see
+        SqliteVersionHistories) can write them as they come instead, so that a
+        scanner feeding it a generator never holds the whole ecosystem in memory.
+        """
+        (da, dc, dv) = (dict(), dict(), dict())
+        for (p, author, pdc, pdv) in packages:
+            da[p] = author
+            dc.setdefault(p, {}).update(pdc)
+            dv.setdefault(p, {}).update(pdv)
+        self.preload(da, dc, dv, end_of_time)
+
+    def update_package(self, package, author, dc, dv):
+        """Add or replace all version information about one package
+
+        author, dc, dv: this package's entries in da, dc, and dv.  The dependency
+        and reverse dependency caches are patched rather than cleared, so this is
+        cheap enough to call for every package touched by an incremental update.
+        """
+        olddeps = set(self.dependencies(package)) if package in self.dv else set()
+        self.da[package] = author
+        self.dc[package] = dc
+        self.dv[package] = dv
+        for v in dc:
+            if dc[v].tzinfo is None:
+                dc[v] = dc[v].replace(tzinfo=pytz.UTC)
+        self.depscache.pop(package, None)
+        self.fingerprints.pop(package, None)
+        self.graphcache = {}
+        self.index_versions(package)
+        self.patch_reverse_dependencies(package, olddeps, self.dependencies(package))
+
+    def remove_package(self, package):
+        """Forget all version information about one package"""
+        if package not in self.dv:
+            return
+        olddeps = set(self.dependencies(package))
+        for d in [self.da, self.dc, self.dv, self.depscache, self.vindex, self.fingerprints]:
+            d.pop(package, None)
+        self.graphcache = {}
+        self.patch_reverse_dependencies(package, olddeps, set())
+
+    def patch_reverse_dependencies(self, package, olddeps, newdeps):
+        """Update cached reverse dependencies after package's dependencies changed"""
+        if len(self.rdepscache) == 0:
+            return
+        for d in olddeps - set(newdeps):
+            self.rdepscache.get(d, set()).discard(package)
+            self.rdeptimes.get(d, {}).pop(package, None)
+        spans = self.all_dep_version_spans(package) if len(newdeps) > 0 else {}
+        for d in newdeps:
+            self.rdepscache.setdefault(d, set()).add(package)
+            self.rdeptimes.setdefault(d, {})[package] = spans[d]
 
     def logging(self, logfn):
         self.logwith = logfn
 
+    def after_fork(self):
+        """Called in each worker process forked to share this VersionHistories (see parallel.py)"""
+        pass
+
     def dep_version_spans(self, package, dep):
         """list of dependency version ref strings, and the timespan over which they were valid"""
         ps = PointSpans()
-        for v in self.versions(package):
+        (vers, dates) = self.version_index(package)
+        for (v, date) in zip(vers, dates):
             if dep in self.dv[package][v] and len(self.dv[package][v][dep]) > 0:
-                ps.addchange(self.dv[package][v][dep][0][1], self.dc[package][v])
+                ps.addchange(self.dv[package][v][dep][0][1], date)
             else:
-                ps.addchange(None, self.dc[package][v])
+                ps.addchange(None, date)
         return list(ps.foreach(self.end_of_time))
 
-    def buildReverseDependencies(self):
+    def all_dep_version_spans(self, package):
+        """{ dep: dep_version_spans(package, dep) } for every dep package has ever had, in one pass over its versions"""
+        spans = {}
+        current = {}
+        (vers, dates) = self.version_index(package)
+        for (v, date) in zip(vers, dates):
+            deps = self.dv[package][v]
+            refs = { d: deps[d][0][1] for d in deps if len(deps[d]) > 0 }
+            for d in deps:
+                if d not in spans:
+                    spans[d] = PointSpans()
+            for d in set(current) | set(refs):
+                if current.get(d) != refs.get(d):
+                    spans[d].addchange(refs.get(d), date)
+            current = refs
+        return { d: list(spans[d].foreach(self.end_of_time)) for d in spans }
+
+    def buildReverseDependencies(self, processes=None, shard_size=1000):
         """Find and cache reverse dependency information
 
-        This is slow, so don't run it if not necessary
+        This is slow, so don't run it if not necessary; serialize() saves the
+        result, so it need not be rebuilt when the data is loaded again.
 
+        Shards of shard_size packages are processed in a pool of processes
+        workers (default: number of cpus); processes=1 runs in this process.
         """
         self.rdepscache = defaultdict(set)
         self.rdeptimes = defaultdict(defaultdict)
-        self.logwith(str(len(self.dc.keys())) + " packages to process")
+        packages = list(self.packages())
+        self.logwith(str(len(packages)) + " packages to process")
+        if processes == 1 or len(packages) <= shard_size:
+            parts = [self.reverse_dependencies_of(packages)]
+        else:
+            parts = parallel.build_reverse_dependencies(self, processes, shard_size)
         pcount = 0
-        for p in self.dc.keys():
-            pcount = pcount + 1
-            if (pcount % 1000 == 0):
-                self.logwith("   package #"+ str(pcount)+ ":" + str(p))
-            for d in self.dependencies(p):
-                self.rdepscache[d].add(p)
-                self.rdeptimes[d][p] = self.dep_version_spans(p, d)
+        for (rdeps, rdeptimes) in parts:
+            for d in rdeps:
+                self.rdepscache[d].update(rdeps[d])
+                self.rdeptimes[d].update(rdeptimes[d])
+            pcount += 1
+            self.logwith("   merged shard #" + str(pcount))
         self.logwith("   ...Done with reverse dependencies")
 
+    def reverse_dependencies_of(self, packages):
+        """Reverse dependency information contributed by some packages
+
+        returns: (dep -> set of packages, dep -> package -> dep_version_spans(package, dep))
+        """
+        rdeps = defaultdict(set)
+        rdeptimes = defaultdict(dict)
+        for p in packages:
+            spans = self.all_dep_version_spans(p)
+            for d in spans:
+                rdeps[d].add(p)
+                rdeptimes[d][p] = spans[d]
+        return (dict(rdeps), dict(rdeptimes))
+
+    def index_versions(self, package):
+        """(Re)build the chronological version index of one package"""
+        vers = sorted(self.dc[package].keys(), key=lambda v: self.dc[package][v])
+        self.vindex[package] = (vers, [self.dc[package][v] for v in vers])
+
+    def version_index(self, package):
+        """([versions], [dates]) of this package, in chrono order
+
+        The lists are shared by every caller, so don't modify them."""
+        if package not in self.vindex:
+            self.index_versions(package)
+        return self.vindex[package]
+
     def versions(self, package):
         """List all known versions of this package, in chrono order"""
-        return sorted(self.dc[package].keys(), key=lambda v: self.dc[package][v])
+        return self.version_index(package)[0]
 
     def date_of_version(self, package, version): return self.dc[package][version]
 
@@ -168,12 +313,43 @@ class VersionHistories():
             self.buildReverseDependencies()
         return self.rdepscache[package]
 
+    def transitive_closure(self, present=True):
+        """TransitiveClosure of present (or all historical) dependencies, built once and cached"""
+        if ("closure", present) not in self.graphcache:
+            self.graphcache[("closure", present)] = TransitiveClosure(self, present)
+        return self.graphcache[("closure", present)]
+
+    def graph_timeline(self, interval=relativedelta(years=1)):
+        """GraphTimeline checkpointed every interval, built once and cached"""
+        if ("timeline", interval) not in self.graphcache:
+            self.graphcache[("timeline", interval)] = GraphTimeline(self, interval)
+        return self.graphcache[("timeline", interval)]
+
+    def constraint_resolver(self, ecosystem=None):
+        """ConstraintResolver for this ecosystem (default: the "ecosystem" aux data), built once and cached"""
+        if ("resolver", ecosystem) not in self.graphcache:
+            self.graphcache[("resolver", ecosystem)] = ConstraintResolver(self, ecosystem)
+        return self.graphcache[("resolver", ecosystem)]
+
+    def resolved_dependencies(self, package):
+        """{ version: { dep: the release of dep its reference resolved to when it was released, or None } }"""
+        return self.constraint_resolver().resolve_package(package)
+
+    def graphAsOf(self, asOfDate):
+        """GraphSnapshot of every package's newest version and its dependencies as of some date"""
+        return self.graph_timeline().asOf(asOfDate)
+
+    def graphsAsOf(self, asOfDates):
+        """GraphSnapshots as of each of several dates"""
+        return self.graph_timeline().asOfDates(asOfDates)
+
     def present_transitive_dependencies(self, package, skip=set()):
-        deps = set(self.present_dependencies(package)) - skip
-        deps1 = set()
-        for d in deps:
-            deps1 = deps1 + self.present_transitive_dependencies(d, deps + skip)
-        return deps + deps1 - skip
+        """Packages that package's latest version depends on, directly or indirectly"""
+        return self.transitive_closure().dependencies(package) - set(skip)
+
+    def present_transitive_dependents(self, package):
+        """Packages whose latest versions depend on package, directly or indirectly"""
+        return self.transitive_closure().dependents(package)
 
     def present_dependencies(self, package):
         return [d for d in self.dv[package][self.latest_version(package)] if d in self.dc]
@@ -193,79 +369,26 @@ class VersionHistories():
 
         Shows version changes to a package, version changes to its dependencies
         and reverse dependencies, and changes to the version numbers specified in
-        the dependency links.
+        the dependency links.  See texttimeline.py, which streams the rows, and
+        texttimeline.history for the order of rows on the same date.
 
         package: the "focal" package to build the visualization around
-        returns: yields a list of strings that can be printed out
+        returns: a list of strings that can be printed out, or None if they were written to file
         """
         self.logwith("Building timeline for"  + str(package))
         if len(self.rdepscache) == 0:
             self.buildReverseDependencies()
-        history = []  # (time, column#, text), column = "revdep", "focal", or "dep"
-    
-        deps = self.dependencies(package)
-        revdeps = self.rdeptimes[package].keys()
-        self.logwith("Package: " + package)
-        for v in self.versions(package):
-            history.append((self.dc[package][v], "focal", package + " v" + v))
-    
-        self.logwith("Dependencies: " + ",".join(deps))
-        self.logwith("Reverse Dependencies:" + ",".join(revdeps))
-    
-        if (abortIfBoring and (len(deps) == 0 or len(revdeps) == 0)):
+        if (abortIfBoring and (len(self.dependencies(package)) == 0 or len(self.rdeptimes[package].keys()) == 0)):
             raise Exception("uninteresting package: ", package)
-    
-        for d in deps:
-            self.logwith("   Dep: "+ str(d))
-            try:
-                for depver in self.dc[d]:
-                     history.append((self.dc[d][depver], "dep", d + " v" + depver))
-            except Exception ,e:
-                self.logwith("     No dep info available for " + str(d) + " Error: " + str(e))
-            try:
-                for (k,st,en) in self.rdeptimes[d][package]:
-                     history.append((st, "dep", "ref: " + package + " -> " + d + " v" + k))
-                     #history.append((en, "dep", "ref: " + package + " -> " + d + " v" + k + " (end)"))
-            except Exception ,e:
-                self.logwith("     No2 dep info available for " + str(d) + " Error: " + str(e))
-        for r in revdeps:
-            self.logwith("   RevDep: "+str(r))
-            try:
-                for rdepver in self.dc[r]:
-                     history.append((self.dc[r][rdepver], "revdep", r + " v" + rdepver))
-            except Exception ,e:
-                self.logwith("     No reverse dep info available for " + str(d) + "  Error:" + str(e))
-            try:
-                for (k,st,en) in self.rdeptimes[package][r]:
-                     history.append((st, "revdep", "ref: " + r + " -> " + package + " v" + k))
-                     #history.append((en, "revdep", "ref: " + r + " -> " + package + " v" + k + " (end)"))
-            except Exception ,e:
-                self.logwith("     No2 reverse dep info available for " + str(d) + "  Error:" + str(e))
-        history = sorted(history, key=lambda (k,c,t): k)
-        lasttime = ""
-       
-        format = "%25s   %{}s   %{}s   %{}s".format(colwidth, colwidth, colwidth)
-        op = [format % ("Time", "Dependency changes", package, "Downstream dependencies")]
-        for (tstamp,colname,text) in history:
-            (tempus, tleft, tmid, tright) = ("", "","","")
-            try:
-                tempus = tstamp.strftime("%Y-%m-%d")
-            except Exception, e:
-                self.logwith("Invalid date", str(tstamp), e)
-                tempus = "(bad date)"
-            if (tempus == lasttime):
-                tempus = ""
-            else:
-                lasttime = tempus
-            if colname == "revdep": tright = text
-            if colname == "focal": tmid = text
-            if colname == "dep": tleft = text
-            op.append(format % (tempus,tleft,tmid,tright))
         if file == None:
-            return op
+            return list(texttimeline.rows(self, package, colwidth))
         else:
             with open(file, "w") as f:
-                f.write("\n".join(op).encode('ascii','ignore'))
+                texttimeline.write_rows(f, texttimeline.rows(self, package, colwidth))
+
+    def export_timelines(self, target, packages=None, colwidth=20):
+        """Write showTimeline of each package (default: all) into a directory or archive; see texttimeline.py"""
+        return texttimeline.export_timelines(self, target, packages, colwidth)
 
     def packages_by_author(self, author_match):
         """Return [(packagename, author)] list of pairs, where author_match is a substring of author"""
@@ -277,20 +400,44 @@ class VersionHistories():
         for p in self.dc:
             yield p
 
-    def interesting_packages(self):
-        for p in self.packages():
-            try:
-                i = self.interesting(p)
-                if i is not None:
-                    yield i
-            except Exception, e:
-                self.logwith("Error checking interestingness of ", p, ":", e)
+    def screen_packages(self, criterion, processes=1, chunksize=100, ordered=True):
+        """Yield (package, result) for each package for which self.<criterion>(package), e.g.
+        interesting or downstreamer, returns something true
+
+        processes: evaluate chunks of chunksize packages in a pool of this many
+                   worker processes (None: number of cpus), which share this
+                   VersionHistories copy-on-write; 1 runs in this process
+        ordered: yield in package order rather than as chunks finish
+        """
+        packages = list(self.packages())
+        if processes == 1:
+            results = ((p,) + self.try_criterion(getattr(self, criterion), p) for p in packages)
+        else:
+            results = parallel.screen(self, criterion, packages, processes, chunksize, ordered)
+        for (p, result, e) in results:
+            if e is not None:
+                self.logwith("Error checking " + criterion + " of ", p, ":", e)
+            elif result:
+                yield (p, result)
+
+    def try_criterion(self, test, p):
+        try:
+            return (test(p), None)
+        except Exception, e:
+            return (None, e)
+
+    def interesting_packages(self, processes=1, chunksize=100, ordered=True):
+        """interesting(p) for each package for which it isn't None; see screen_packages"""
+        if processes != 1 and len(self.rdepscache) == 0:
+            self.buildReverseDependencies(processes)
+        for (p, i) in self.screen_packages("interesting", processes, chunksize, ordered):
+            yield i
 
     def recently_active(self, p, recent_date = None, activity_level = 2):
         if recent_date is None:
             recent_date = self.end_of_time.replace(year = self.end_of_time.year - 1)
-        recent_changes = [v for v in self.versions(p) if self.dc[p][v] > recent_date]
-        return len(recent_changes) >= activity_level
+        dates = self.version_index(p)[1]
+        return len(dates) - bisect.bisect_right(dates, recent_date) >= activity_level
             
     def latest_version(self, p): 
         try:
@@ -316,21 +463,6 @@ class VersionHistories():
         #if (small_downstream and explain):
         #    self.logwith("\tSmall downstream:", auth, "!=", ",".join([self.author(d) for d in rds]))
 
-        # http://stackoverflow.com/questions/18715688/find-common-substring-between-two-strings
-        def longestSubstringFinder(string1, string2):
-            answer = ""
-            len1, len2 = len(string1), len(string2)
-            for i in range(len1):
-                match = ""
-                for j in range(len2):
-                    if (i + j < len1 and string1[i + j] == string2[j]):
-                        match += string2[j]
-                    else:
-                        if (len(match) > len(answer)): answer = match
-                        match = ""
-            return answer
-
-
         pd = self.present_dependencies(p)
         best = ""
         for upstr in pd:
@@ -338,7 +470,7 @@ class VersionHistories():
             if len(vch) > 8:
                  if explain:
                      self.logwith("\t" + str(len(vch)) + " changes to upstream " + upstr)
-                 common = longestSubstringFinder(self.author(p), self.author(upstr))
+                 common = self.authorsim.common(self.author(p), self.author(upstr))
                  if explain:
                      self.logwith("\tLongest common author substring is " + common)
                  if len(common) < 8:
@@ -378,26 +510,53 @@ class VersionHistories():
         if (diverse_downstream and explain):
             self.logwith("\tDiverse downstream:", auth, "!=", ",".join([self.author(d) for d in rds]))
 
-        recently_updated = (self.end_of_time - self.dc[p][self.latest_version(p)]).total_seconds() < 365*24*24*60;
+        latest_date = self.version_index(p)[1][-1]
+        recently_updated = (self.end_of_time - latest_date).total_seconds() < 365*24*24*60;
         if (recently_updated and explain):
-            self.logwith("\tRecently updated:", self.latest_version(p), " update on ", self.dc[p][self.latest_version(p)])
+            self.logwith("\tRecently updated:", self.latest_version(p), " update on ", latest_date)
 
         if (diverse_upstream and diverse_downstream and recently_updated and busy_upstreams):
             return (p, pd, rd)
         else:
             return None
 
-    def dep_version_changes(self, p):
-        """List of circumstances (version) when package changed what version of dep it pointed to"""
-        lastversion = ""
-        result = {}
-        for v in self.versions(p):
-            thisversion = json.dumps(self.dv[p][v], indent=4)
-            if thisversion != lastversion:
-                result[v] = thisversion
-            lastversion = thisversion
+    def dep_fingerprint(self, package, version):
+        """sha1 of one version's dependencies, the same however the dict happens to be ordered"""
+        deps = self.dv[package][version]
+        return hashlib.sha1(json.dumps(sorted((d, deps[d]) for d in deps))).hexdigest()
+
+    def dep_fingerprints(self, package):
+        """dep_fingerprint of each version of package, in chrono order; computed once and cached"""
+        if package not in self.fingerprints:
+            self.fingerprints[package] = [self.dep_fingerprint(package, v) for v in self.versions(package)]
+        return self.fingerprints[package]
+
+    def dep_diff(self, package, old, new):
+        """(added, removed, changed): sorted lists of the deps that version new of package added,
+        dropped, or declared differently, compared to version old (None: no dependencies)"""
+        olddeps = self.dv[package][old] if old is not None else {}
+        newdeps = self.dv[package][new]
+        return (sorted(d for d in newdeps if d not in olddeps),
+                sorted(d for d in olddeps if d not in newdeps),
+                sorted(d for d in newdeps if d in olddeps and newdeps[d] != olddeps[d]))
+
+    def dep_changes(self, p):
+        """[(version, added, removed, changed)] for each version of p whose dependencies differ
+        from the previous version's (the first version adds all of its dependencies)
+
+        Consecutive versions are compared by fingerprint, and only diffed when they differ."""
+        result = []
+        (lastversion, lastprint) = (None, None)
+        for (v, fingerprint) in zip(self.versions(p), self.dep_fingerprints(p)):
+            if fingerprint != lastprint:
+                result.append((v,) + self.dep_diff(p, lastversion, v))
+            (lastversion, lastprint) = (v, fingerprint)
         return result
 
+    def dep_version_changes(self, p):
+        """{ version: (added, removed, changed) } for each version when package changed its dependencies"""
+        return { c[0]: c[1:] for c in self.dep_changes(p) }
+
     def dep_versions(self, p, dep):
         """List of circumstances (version) when package changed what version of dep it pointed to"""
         lastversion = ""
@@ -415,25 +574,12 @@ class VersionHistories():
                 lastversion = thisversion
         return result
 
-    def todo(self):
-        """Functions still to be ported from previous implementation
-
-    def allHistories(self):
-        (rd, rdt) = buildReverseDependencies()
-        for pk in npmKeys(npms):
-            try:
-                timel = list(showTimeline(pk, rd, rdt))
-                pkn = pk.replace("/", "_")
-                with open ("timelines/" + pkn + ".timeline.txt", "w") as f:
-                    f.write("\n".join(timel))
-            except Exception, e:
-                print e
-        """
-
     def author(self, p): return self.da.get(p,"")
 
-    def graph_package_deps(self, p, pngname):
-    
+    def graph_package_deps(self, p, pngname, strict=False):
+        import matplotlib.pyplot as plt
+        from timeline import Timeline
+
         tl = Timeline()
         
         def epoch(t): return t.toordinal() #float(t.strftime("%s"))
@@ -445,33 +591,34 @@ class VersionHistories():
         reflbar = "PaleGoldenrod"
         
 
-        vers_names = self.versions(p)
+        (vers_names, vers_dates) = self.version_index(p)
 
         # extend each version until the end of hte subsequent version
-        for v,w in zip(vers_names[:-1], vers_names[1:]):     # Lost author for author color
-            tl.span(p, epoch(self.dc[p][v]), epoch(self.dc[p][w]), p + ":" + v, v, authColor(p), None)
+        for v,st,en in zip(vers_names[:-1], vers_dates[:-1], vers_dates[1:]):     # Lost author for author color
+            tl.span(p, epoch(st), epoch(en), p + ":" + v, v, authColor(p), None)
         vlast = vers_names[-1]
-        tl.span(p, epoch(self.dc[p][vlast]), epoch(self.end_of_time), p + ":" + vlast, vlast, authColor(p), None)
+        tl.span(p, epoch(vers_dates[-1]), epoch(self.end_of_time), p + ":" + vlast, vlast, authColor(p), None)
     
+        resolved = self.resolved_dependencies(p)
         for dep in self.dependencies(p):
             for (ref,st,en) in self.dep_version_spans(p, dep):
                 tl.span(dep, epoch(st), epoch(en), dep + "::" + ref, ref, reflbar, "bottom")
     
             depvers = self.dep_versions(p, dep)
             try:
-                vn2 = self.versions(dep)
-                for vv,ww in zip(vn2[:-1], vn2[1:]):
-                    self.logwith( "deploop", vv,ww, self.dc[dep].keys())
-                    tl.span(dep, epoch(self.dc[dep][vv]), epoch(self.dc[dep][ww]),
+                (vn2, vd2) = self.version_index(dep)
+                for vv,ww,st,en in zip(vn2[:-1], vn2[1:], vd2[:-1], vd2[1:]):
+                    self.logwith( "deploop", vv,ww, vn2)
+                    tl.span(dep, epoch(st), epoch(en),
                             dep + ":" + vv, vv, authColor(dep), "top") 
                 vvlast = vn2[-1]
-                tl.span(dep, epoch(self.dc[dep][vvlast]), epoch(self.end_of_time),
+                tl.span(dep, epoch(vd2[-1]), epoch(self.end_of_time),
                        dep + ":" + vvlast, vvlast, authColor(dep), "top") 
             except Exception, e:
                 self.logwith("Exception processing dependency", dep, e)
             for vn in vers_names:
                 if vn in depvers:
-                    dep_ver = self.extractVersionLimiter(depvers[vn])
+                    dep_ver = resolved[vn].get(dep) or ""
                     self.logwith( dep_ver)
                     destrec = tl.findByKey(dep + ":" + dep_ver)
                     srcrec = tl.findByKey(p + ":" + vn)
@@ -491,57 +638,51 @@ class VersionHistories():
             tl.draw_bars(ax)
             tl.draw_connections(ax)
             t = plt.title("Upstream dependencies: packages that " + p + " depends on\n ", fontsize=90)
-            savefig(pngname, bbox_extra_artists=[t], bbox_inches="tight")
+            plt.savefig(pngname, bbox_extra_artists=[t], bbox_inches="tight")
         except Exception, e:
+            if strict:
+                plt.close("all")
+                raise
             import traceback
             traceback.print_exc()
             print("Error drawing figure for ", p, ":", e)
         plt.close("all")
 
+    def package_stats(self):
+        """PackageStats of every package, built once and cached"""
+        if "stats" not in self.graphcache:
+            self.graphcache["stats"] = PackageStats(self)
+        return self.graphcache["stats"]
+
     def average_update_frequency(self):
-        return self.average_update_frequency_criterion( lambda p: True)
+        (frequency, applicable) = self.package_stats().update_frequency()
+        print("Of", applicable.sum())
+        return float(frequency[applicable].mean())
 
     def average_update_frequency_of_upstreams(self):
-        return self.average_update_frequency_criterion(
-            lambda p: len(list(self.reverse_dependencies(p))) > 0)
-
+        stats = self.package_stats()
+        (frequency, applicable) = stats.update_frequency()
+        applicable &= stats.column("reverse_dependency_count") > 0
+        print("Of", applicable.sum())
+        return float(frequency[applicable].mean())
 
     def average_update_frequency_criterion(self, criterion):
-        countable = 0
-        auf = 0.0
-        for p in self.packages():
-            try:
-                if criterion(p):
-                    uf = self.update_frequency(p)
-                    auf = auf + uf
-                    countable += 1
-            except NotApplicable:
-                pass
-        print("Of", countable)
-        return auf/countable
+        stats = self.package_stats()
+        (frequency, applicable) = stats.update_frequency()
+        applicable &= stats.mask(criterion)
+        print("Of", applicable.sum())
+        return float(frequency[applicable].mean())
 
     def average_dependency_update_frequency(self):
-        countable = 0
-        auf = 0.0
-        for p in self.packages():
-            try:
-                uf = self.dependency_update_frequency(p)
-                auf = auf + uf
-                if (uf > 1.5):
-                    pass
-                    #print("Package",p,"Has short dependency update frequency of",uf, (1.0/uf))
-                    #pdb.set_trace()
-                countable += 1
-            except:
-                pass
-        print("Of", countable)
-        return auf/countable
+        (frequency, applicable) = self.package_stats().dependency_update_frequency()
+        print("Of", applicable.sum())
+        return float(frequency[applicable].mean())
 
     def update_frequency(self, p):
         """How many times per day was package updated (usually a fraction less than one)"""
-        num_updates = len(self.versions(p))
-        dates = [self.dc[p][ver] for ver in self.dc[p]]
-        span = max(dates)-min(dates)
+        dates = self.version_index(p)[1]
+        num_updates = len(dates)
+        span = dates[-1]-dates[0]
         if len(dates) < 2:
             print(p,"has only one revision")
             import pdb
@@ -553,17 +694,19 @@ class VersionHistories():
             return (num_updates-1)*1.0/span.days    
 
     def dependency_update_frequency(self, p):
-        num_updates = len(self.dep_version_changes(p))
-        dates = [self.dc[p][ver] for ver in self.dc[p]]
-        span = max(dates)-min(dates)
+        num_updates = len(self.dep_changes(p))
+        dates = self.version_index(p)[1]
+        span = dates[-1]-dates[0]
         if (len(list(self.reverse_dependencies(p))) == 0):
             raise Exception("Package without deps")
         return (num_updates-1)*1.0/span.days    
 
 
 
-    def graph_package_downstreams(self, p, pngname):
-    
+    def graph_package_downstreams(self, p, pngname, strict=False):
+        import matplotlib.pyplot as plt
+        from timeline import Timeline
+
         tl = Timeline()
         
         def epoch(t): return t.toordinal() #float(t.strftime("%s"))
@@ -572,8 +715,9 @@ class VersionHistories():
 
         reflbar = "PaleGoldenrod"
         
-        vers_names = self.versions(p)
+        (vers_names, vers_dates) = self.version_index(p)
 
+        links = []
         # Just show the first 20; the image gets too big otherwise
         for dep in list(self.reverse_dependencies(p))[:20]:
             for (ref,st,en) in self.dep_version_spans(dep, p):
@@ -587,38 +731,38 @@ class VersionHistories():
     
             depvers = self.dep_versions(dep, p)
             try:
-                vn2 = self.versions(dep)
-                for vv,ww in zip(vn2[:-1], vn2[1:]):
-                    self.logwith( "deploop", vv,ww, self.dc[dep].keys())
-                    tl.span(dep, epoch(self.dc[dep][vv]), epoch(self.dc[dep][ww]),
+                (vn2, vd2) = self.version_index(dep)
+                for vv,ww,st,en in zip(vn2[:-1], vn2[1:], vd2[:-1], vd2[1:]):
+                    self.logwith( "deploop", vv,ww, vn2)
+                    tl.span(dep, epoch(st), epoch(en),
                             dep + ":" + vv, vv, authColor(dep), "top") 
                 vvlast = vn2[-1]
-                tl.span(dep, epoch(self.dc[dep][vvlast]), epoch(self.end_of_time),
+                tl.span(dep, epoch(vd2[-1]), epoch(self.end_of_time),
                        dep + ":" + vvlast, vvlast, authColor(dep), "top") 
+                # link each version that changed its reference to p to the release of p it resolved to
+                resolved = self.resolved_dependencies(dep)
+                for vn in vn2:
+                    if vn in depvers and p in resolved[vn]:
+                        links.append((dep, vn, resolved[vn][p] or ""))
             except Exception, e:
                 self.logwith("Exception processing dependency", dep, e)
-            for vn in vers_names:
-                if vn in depvers:
-                    dep_ver = self.extractVersionLimiter(depvers[vn])
-                    self.logwith( dep_ver)
-                    destrec = tl.findByKey(dep + ":" + dep_ver)
-                    srcrec = tl.findByKey(p + ":" + vn)
-                    if len(destrec) > 0 and len(srcrec) > 0:
-                        tl.connect(destrec[0], srcrec[0])
-                        self.logwith( "version", vn, "of", p, "did link to dependency", dep, "version", dep_ver)
-                    else:
-                        self.logwith( "version", vn, "of", p, "***can't*** find dependency", \
-                               dep, "version", dep_ver, "lendestrec=", len(destrec), "lensrcrec=", len(srcrec))
-                else:
-                    self.logwith(vn,"is not in",list(depvers))
-                    self.logwith( "version", vn, "of", p, "did not update dependency on", dep)
 
         # extend each version until the end of hte subsequent version
-        for v,w in zip(vers_names[:-1], vers_names[1:]):     # Lost author for author color
-            tl.span(p, epoch(self.dc[p][v]), epoch(self.dc[p][w]), p + ":" + v, v, authColor(p), None)
+        for v,st,en in zip(vers_names[:-1], vers_dates[:-1], vers_dates[1:]):     # Lost author for author color
+            tl.span(p, epoch(st), epoch(en), p + ":" + v, v, authColor(p), None)
 
         vlast = vers_names[-1]
-        tl.span(p, epoch(self.dc[p][vlast]), epoch(self.end_of_time), p + ":" + vlast, vlast, authColor(p), None)
+        tl.span(p, epoch(vers_dates[-1]), epoch(self.end_of_time), p + ":" + vlast, vlast, authColor(p), None)
+
+        for (dep, vn, p_ver) in links:
+            destrec = tl.findByKey(p + ":" + p_ver)
+            srcrec = tl.findByKey(dep + ":" + vn)
+            if len(destrec) > 0 and len(srcrec) > 0:
+                tl.connect(destrec[0], srcrec[0])
+                self.logwith( "version", vn, "of", dep, "did link to dependency", p, "version", p_ver)
+            else:
+                self.logwith( "version", vn, "of", dep, "***can't*** find dependency", \
+                       p, "version", p_ver, "lendestrec=", len(destrec), "lensrcrec=", len(srcrec))
     
     
         try:
@@ -627,59 +771,88 @@ class VersionHistories():
             tl.draw_bars(ax)
             tl.draw_connections(ax)
             t = plt.title("Downstream dependencies: packages that depend on " + p + "\n ", fontsize=90)
-            savefig(pngname, bbox_extra_artists=[t], bbox_inches="tight")
+            plt.savefig(pngname, bbox_extra_artists=[t], bbox_inches="tight")
         except Exception, e:
+            if strict:
+                plt.close("all")
+                raise
             import traceback
             traceback.print_exc()
             print("Error drawing figure for ", p, ":", e)
         plt.close("all")
 
-    vlimit = re.compile("\d[\.[a-z_A-Z0-9-]]+")
-    def extractVersionLimiter(self, limit):
-        ans = VersionHistories.vlimit.search(limit)
-        if ans is None:
-            return ""
-        else:
-            return "/" + str(ans.group(0))
+    def investigate(self, plots, colwidth=20, processes=1, chunksize=100, force=False):
+        """Draw timelines and graphs of each interesting package into the plots directory
+
+        Packages are screened (see screen_packages) and then rendered (see
+        render.render_packages) by processes workers; only outputs whose inputs
+        changed since they were drawn are redrawn, unless force.  Returns
+        render_packages' summary."""
+        packages = [p for (p, pd, rd) in self.interesting_packages(processes, chunksize, ordered=False)]
+        return render.render_packages(self, plots, packages, processes, colwidth, force)
 
-    def investigate(self, plots, colwidth=20):
-        for (p, pd, rd) in self.interesting_packages():
-            self.dumpVis(plots, p, colwidth=colwidth)
+    def dumpVis(self, plots, p, colwidth=20, force=False):
+        """Draw p's timeline and graphs into the plots directory, reusing those whose inputs haven't changed"""
+        render.render_package(self, plots, p, colwidth, force)
 
-    def dumpVis(self, plots, p, colwidth=20):
-        self.showTimeline(p, colwidth=colwidth, file=plots + "/" + p + ".timeline.txt")
-        self.graph_package_deps(p, plots + "/" + p + ".svg")
-        self.graph_package_downstreams(p, plots + "/" + p + ".down.svg")
+    earliest_date = datetime.datetime(1971,1,1,0,0,tzinfo=pytz.UTC)
 
     def versionAsOf(self, p, asOfDate):
         "What version of package p was newest as of some date?"
-        maxver = None
-        maxverdate = datetime.datetime(1971,1,1,0,0,tzinfo=pytz.UTC)
-        for (ver, verdate) in self.dc[p].iteritems():
-            if verdate > maxverdate and verdate < asOfDate:
-                maxver = ver
-                maxverdate = verdate
-        return maxver
+        (vers, dates) = self.version_index(p)
+        i = bisect.bisect_left(dates, asOfDate)
+        if i == 0 or dates[i-1] <= VersionHistories.earliest_date:
+            return None
+        return vers[i-1]
+
+    def versionsAsOf(self, p, asOfDates):
+        """What version of package p was newest as of each of several dates?
+
+        Makes a single pass over p's versions; returns a list parallel to asOfDates,
+        with None for dates before p's first version"""
+        (vers, dates) = self.version_index(p)
+        result = [None] * len(asOfDates)
+        i = 0
+        for k in sorted(range(len(asOfDates)), key=lambda k: asOfDates[k]):
+            while i < len(dates) and dates[i] < asOfDates[k]:
+                i += 1
+            if i > 0 and dates[i-1] > VersionHistories.earliest_date:
+                result[k] = vers[i-1]
+        return result
 
     def depCountAsOf(self, p, asOfDate):
         "How many dependencies did package p have as of some date?"
         v = self.versionAsOf(p, asOfDate)
         return len(set(self.dv[p][v].keys()) - set(defaultLoaded))
 
+    def depCountsAsOf(self, p, asOfDates):
+        """How many dependencies did package p have as of each of several dates?
+
+        returns a list parallel to asOfDates, with None for dates before p's first version"""
+        return [None if v is None else len(set(self.dv[p][v].keys()) - set(defaultLoaded))
+                    for v in self.versionsAsOf(p, asOfDates)]
+
     def depCountsAll2versions(self, asOfDate):
-        for p in self.dv:
-          if self.numDistinctVersionDates(p) > 1:
-            try:
-                yield self.depCountAsOf(p,asOfDate)
-            except KeyError:
-                pass
+        return self.depCountsAllDates([asOfDate], distinctVersionsOnly=True)[asOfDate]
 
     def depCountsAll(self, asOfDate):
-        for p in self.dv:
-            try:
-                yield self.depCountAsOf(p,asOfDate)
-            except KeyError:
-                pass
+        return self.depCountsAllDates([asOfDate])[asOfDate]
+
+    def depCountsAllDates(self, asOfDates, distinctVersionsOnly = False):
+        """Dependency counts of every package as of each of several dates, in one pass over every release
+
+        returns: { date: [dependency count of each package that existed then] }"""
+        packages = [p for p in self.dv if not (distinctVersionsOnly and self.numDistinctVersionDates(p) < 2)]
+        [series] = sweep.sweep(self, [sweep.DependencyCounts(defaultLoaded, packages)], asOfDates, packages)
+        return dict(zip(sorted(asOfDates), series))
+
+    def ecosystem_series(self, reducers, start, end=None, resolution=relativedelta(months=1)):
+        """Time series of several ecosystem statistics (see sweep.py) every resolution from start to end
+
+        All the reducers are fed from a single chronological pass over every package.
+        returns: (dates, [series of each reducer])"""
+        asOfDates = sweep.periods(start, end or self.end_of_time, resolution)
+        return (asOfDates, sweep.sweep(self, reducers, asOfDates))
 
     def numDistinctVersionDates(self, p):
         return len(set(self.dc[p].values()))
@@ -29,10 +29,10 @@ def demoEclipse():
 
 def demoNpm():
     print "Scanning"
-    with open("/Users/cbogart/sandbox/npmjson.json", "r") as f:
-       vh = depalyze.VersionHistories()
-       vh.deserialize(json.loads(f.read(), object_hook=json_util.object_hook))
-    #vh = depalyze.scan_npm_json("/users/cbogart/data/npmjs.json")
+    vh = depalyze.open_snapshot("/Users/cbogart/sandbox/npm.snapshot")
+    # The snapshot is written once, after a scan, with:
+    #vh = depalyze.scan_npm_json("/users/cbogart/data/npmjs.json", stream=True)
+    #depalyze.write_snapshot(vh, "/Users/cbogart/sandbox/npm.snapshot")
     #print "Validating"
     #vh.validate()
     print "Plotting"
@@ -0,0 +1,45 @@
+"""Time importing depalyze in fresh interpreters, and fail if it has gotten heavier
+
+usage: python import_benchmark.py [budget in seconds, default 0.5] [runs, default 5]
+
+Exits with status 1 if importing depalyze loads any plotting module
+(matplotlib is only imported once something is drawn), or if the fastest
+of the runs takes longer than the budget.
+"""
+import json
+import subprocess
+import sys
+
+PLOTTING = ["matplotlib", "pylab", "timeline", "depalyze.timeline"]
+
+MEASURE = """
+import json, sys, time
+start = time.time()
+import depalyze
+print(json.dumps({ "seconds": time.time() - start, "modules": sorted(sys.modules) }))
+"""
+
+def measure():
+    return json.loads(subprocess.check_output([sys.executable, "-c", MEASURE]))
+
+def main(budget=0.5, runs=5):
+    results = [measure() for i in range(runs)]
+    best = min(r["seconds"] for r in results)
+    plotting = sorted(set(m if m in PLOTTING else m.split(".")[0] for m in results[0]["modules"]
+                          if m in PLOTTING or m.split(".")[0] in PLOTTING))
+    print "import depalyze: best of", runs, "runs %.3f seconds (budget %.3f)," % (best, budget), \
+          len(results[0]["modules"]), "modules loaded"
+    ok = True
+    if len(plotting) > 0:
+        print "FAIL: importing depalyze loaded plotting modules:", ", ".join(plotting)
+        ok = False
+    if best > budget:
+        print "FAIL: importing depalyze took longer than the budget"
+        ok = False
+    return ok
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    budget = float(args[0]) if len(args) > 0 else 0.5
+    runs = int(args[1]) if len(args) > 1 else 5
+    sys.exit(0 if main(budget, runs) else 1)
@@ -0,0 +1,62 @@
+"""Check that a refresh which changes nothing leaves every plot's digest alone
+
+usage: python render_digest_check.py [packages, default 200]
+
+Builds a small made-up npm ecosystem, whose previous refresh was a day ago,
+and applies an empty change feed to it with apply_npm_changes, which only
+moves end_of_time up to the present.  Exits with status 1 if that changes the
+digest of any output, other than the plots of a package whose horizon (the
+end_of_time bucket its plots show) has just rolled over.
+"""
+import datetime
+import random
+import sys
+import pytz
+from depalyze import VersionHistories, npmscan, render
+
+def npm_doc(p, rng, start):
+    """An _all_docs document for package p with a few releases, depending on earlier packages"""
+    when = start + datetime.timedelta(days=rng.randint(0, 2000))
+    (times, versions) = ({}, {})
+    for i in range(rng.randint(1, 6)):
+        v = "1." + str(i) + ".0"
+        times[v] = when.isoformat()
+        versions[v] = { "dependencies": { "p" + str(rng.randint(0, p - 1)): "^1." + str(rng.randint(0, 3)) + ".0"
+                                          for j in range(rng.randint(0, 3)) } if p > 0 else {} }
+        when += datetime.timedelta(days=rng.randint(1, 200))
+    return { "time": times, "versions": versions, "author": { "name": "author" + str(p % 7) } }
+
+def ecosystem(n, seed=1):
+    rng = random.Random(seed)
+    start = datetime.datetime(2012, 1, 1, tzinfo=pytz.UTC)
+    rows = [{ "key": "p" + str(p), "doc": npm_doc(p, rng, start) } for p in range(n)]
+    vh = VersionHistories()
+    vh.preload_packages(npmscan.npm_packages(rows), datetime.datetime.now(pytz.UTC) - datetime.timedelta(days=1))
+    vh.buildReverseDependencies(processes=1)
+    return vh
+
+def snapshot(vh):
+    return { p: (render.horizon(vh, p), render.input_digests(vh, p)) for p in vh.packages() }
+
+def main(n=200):
+    vh = ecosystem(n)
+    before = snapshot(vh)
+    npmscan.apply_npm_changes(vh, [])
+    after = snapshot(vh)
+    (changed, rolled) = ([], 0)
+    for p in sorted(before):
+        ((h0, d0), (h1, d1)) = (before[p], after[p])
+        if h0 != h1:
+            rolled += 1
+            d0 = dict(d0, deps=None, downstreams=None)
+            d1 = dict(d1, deps=None, downstreams=None)
+        changed.extend(p + " " + kind for kind in sorted(d0) if d0[kind] != d1[kind])
+    print "no-op refresh of", len(before), "packages:", len(changed), "digests changed,", \
+          rolled, "horizons rolled over"
+    for c in changed:
+        print "FAIL: digest changed:", c
+    return len(changed) == 0
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    sys.exit(0 if main(int(args[0]) if len(args) > 0 else 200) else 1)
@@ -33,5 +33,9 @@ setup(
 
     keywords='sample setuptools development',
     packages=['depalyze'],
-    install_requires=['matplotlib', 'numpy', 'pytz', 'python-dateutil']
+    install_requires=['numpy', 'pytz', 'python-dateutil'],
+    extras_require={
+        'stream': ['ijson'],
+        'plots': ['matplotlib'],
+    }
 )